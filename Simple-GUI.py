@@ -10,19 +10,59 @@ pymediainfo: The MIT License
 FFmpeg: (L)GPL v3
 """
 
+import time
+
+STARTUP_TIME = time.perf_counter()
+
 import json
 import os
+import sys
 import queue
-import time
+import platform
 import re
 import uuid
 import threading
 import subprocess
 from pathlib import Path
 from collections import deque
+from itertools import islice
+from functools import lru_cache
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class LazyModule:
+    """Stand-in for a module that is not imported until one of its attributes is used.
+
+    Keeps startup fast, and lets the program run without a GUI toolkit when no window is needed.
+    The module is imported by a function with a plain import statement, so pyinstaller still finds it.
+    """
 
-import PySimpleGUIQt as sg
-from pymediainfo import MediaInfo
+    def __init__(self, load):
+        """
+        :param load: (function) imports and returns the module
+        """
+        self._load = load
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = self._load()
+        return getattr(self._module, attr)
+
+
+def _import_sg():
+    import PySimpleGUIQt
+    return PySimpleGUIQt
+
+
+def _import_pymediainfo():
+    import pymediainfo
+    return pymediainfo
+
+
+sg = LazyModule(_import_sg)
+pymediainfo = LazyModule(_import_pymediainfo)  # Only needed once the first input file is analyzed
 
 try:
     from subprocess import DEVNULL
@@ -57,7 +97,6 @@ __status__ = "dev"
 # TODO: sometimes, especially when crashing, the ffmpeg process will get orphaned
 
 # Misc code stuff
-# TODO: size analysis reports wrong track size
 # TODO: find a way to detect when encode stopped without finishing or being cancelled
 # TODO: program sometimes crashes, prevent this...
 # TODO: clean up docstrings and comments
@@ -68,10 +107,50 @@ __status__ = "dev"
 stoprequest = threading.Event()
 encode_running = threading.Event()
 encode_queue_active = threading.Event()
+calibration_running = threading.Event()
+take_lock = threading.Lock()
 
 _sentinel = object()
 _skip = object()
 
+ANALYSIS_WORKERS = 2  # Number of threads analyzing finished encodes
+METRIC_SEGMENTS = 4  # Number of segments sampled when measuring SSIM/PSNR
+METRIC_SEGMENT_LENGTH = 2  # Length in seconds of each sampled segment
+FRAME_TOLERANCE = 2  # How many frames an encode can differ from the expected count, to allow for rounding of timestamps
+
+LOG_LINES = 5000  # Lines kept in memory for the log view
+JOB_LOG_LINES = 500  # Lines kept in memory for each job
+LOG_VIEW_ROWS = 12  # Lines rendered in the log view
+LOG_FILE_SIZE = 1048576  # Size in bytes before the log file is rotated
+LOG_FILE_COUNT = 3  # Number of rotated log files to keep
+
+THEMES_PER_PAGE = 18  # Number of themes previewed at a time in the theme window
+THEMES_PER_ROW = 6
+PRESETS = {0: "placebo", 1: "placebo", 2: "placebo", 3: "placebo", 4: "veryslow", 5: "slower", 6: "slow", 7: "medium", 8: "fast", 9: "faster", 10: "veryfast", 11: "superfast", 12: "ultrafast"}
+PIXELS_1080P = 1920 * 1080
+PIXELS_4K = 3840 * 2160
+
+CALIBRATION_PRESETS = range(4, 13)  # 0-3 are all placebo and far too slow to be worth calibrating
+CALIBRATION_QPS = (20, 26)
+CALIBRATION_FRAMES = 240  # Length of the reference clip
+
+INDEX_CACHE = Path("index_cache")  # Folder for the keyframe and scene change indexes
+INDEX_HEADER = "<3q"  # Length of the keyframe, scene time and scene score arrays in an index file
+NOPTS_VALUE = -0x8000000000000000  # What ffmpeg prints for a missing timestamp
+SCENE_THRESHOLD = 0.3  # Scene score needed to count as a scene change
+SCENE_SAFE_TOLERANCE = 2.0  # How many seconds a split point can be moved to land on a scene change
+AUTOCROP_POINTS = 5  # Number of places crop is detected when the input is indexed
+AUTOCROP_SAMPLE = 16  # Seconds of video crop is detected on at each place
+
+HEARTBEAT_INTERVAL = 5  # Seconds between heartbeats from encode workers
+LEASE_TIMEOUT = 30  # Seconds without hearing from a worker before its job is given to someone else
+WORKER_RETRY = 5  # Seconds a worker waits before reconnecting to the dispatcher
+ASSIGN_TIMEOUT = 1  # Seconds the dispatcher waits for a job before checking that the worker is still connected
+
+STARTUP_BUDGET = 0.3  # Seconds allowed for loading this module, checked by --benchmark-startup
+DEFERRED_MODULES = ["PySimpleGUIQt", "pymediainfo", "socket", "mmap", "logging", "concurrent.futures", "tempfile", "hashlib", "argparse"]  # Must not be imported while loading this module
+GUI_STARTUP_BUDGET = 3.0  # Seconds allowed from launching the program until the window is up, checked by --benchmark-startup
+
 
 def calc_time(start_time, end_time):
     """Calculate elapsed time between two times"""
@@ -91,7 +170,217 @@ def format_seconds(seconds):
         return "{:.2f} hours".format(seconds / 3600)
 
 
-def encode_thread(encode_queue, gui_queue, status_deque, encode_event):
+class LogStore:
+    """Thread-safe log that keeps memory use bounded no matter how long the program runs.
+
+    The main log is a ring buffer of the latest lines, each job gets its own smaller ring buffer,
+    and everything is also written to a rotating log file. The store can replace sys.stdout so print() ends up here.
+    """
+
+    def __init__(self, log_path=None, max_lines=LOG_LINES, job_lines=JOB_LOG_LINES):
+        """
+        :param log_path: (pathlib.Path) where to write the rotating log file, or None to only keep the log in memory
+        :param max_lines: (int) the number of lines kept in the main log
+        :param job_lines: (int) the number of lines kept for each job
+        """
+        self.lines = deque(maxlen=max_lines)
+        self.jobs = {}
+        self.job_lines = job_lines
+        self.version = 0  # Number of lines ever added to the main log, lets the view know when to redraw
+        self._partial = ""
+        self._lock = threading.Lock()
+
+        import logging
+        from logging.handlers import RotatingFileHandler
+        self._logger = logging.getLogger("svt_gui")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        if log_path and not self._logger.handlers:
+            handler = RotatingFileHandler(str(log_path), maxBytes=LOG_FILE_SIZE, backupCount=LOG_FILE_COUNT, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self._logger.addHandler(handler)
+
+    encoding = "utf-8"
+    errors = "strict"
+
+    def __len__(self):
+        return len(self.lines)
+
+    def isatty(self):
+        return False
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        """Add text to the main log. Lines are only added once they are complete, like a terminal would"""
+        with self._lock:
+            *complete, self._partial = (self._partial + text).split("\n")
+            for line in complete:
+                self.lines.append(line)
+                self._logger.info(line)
+            self.version += len(complete)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def job(self, job_id, text):
+        """Add text to the log of a job. Job logs are written to the log file, but kept out of the main log"""
+        with self._lock:
+            job_log = self.jobs.setdefault(job_id, deque(maxlen=self.job_lines))
+            for line in text.splitlines():
+                job_log.append(line)
+                self._logger.info("[%s] %s", job_id, line)
+
+    def job_log(self, job_id):
+        """Get a copy of the log of a job"""
+        with self._lock:
+            return list(self.jobs.get(job_id, []))
+
+    def forget(self, job_id):
+        """Drop the log of a job that is no longer needed"""
+        with self._lock:
+            self.jobs.pop(job_id, None)
+
+    def view(self, rows, back=0):
+        """Get only the lines that fit in the log view
+
+        :param rows: (int) how many lines the view can show
+        :param back: (int) how many lines the view is scrolled back from the newest line
+        :return: the visible lines joined as a string
+        """
+        with self._lock:
+            end = max(0, len(self.lines) - back)
+            return "\n".join(islice(self.lines, max(0, end - rows), end))
+
+
+def run_encode(params, gui_queue, status_deque, encode_event, log):
+    """Run one encode job and report progress while it runs. Does not need the GUI, so encode workers can use it as well.
+
+    :param params: (dict) the job, as it is stored in the encode list
+    :param gui_queue: (queue.Queue) Queue to communicate back to GUI that task is completed
+    :param status_deque: (collections.deque) Deque used for updating stats during encode
+    :param encode_event: (queue.Queue) Queue which lets the thread send an event when a job starts and finishes
+    :param log: (LogStore) Log where the output from ffmpeg is kept for each job
+    :return: a tuple of (number of frames encoded, whether the encode was stopped)
+    """
+    # todo: are we sure the values in the dict are always there?
+    command = params["command"]
+    test_encode = params["test_encode"]
+    metadata = params["metadata"]
+    job_id = params["uuid"]
+    total_frames = test_encode if test_encode else (int(metadata["frame_count"]) if metadata["frame_count"] else None)
+
+    done_frames = 0
+
+    print('Starting encode of ' + params["title"] + " - " + job_id)
+    encode_event.put({"uuid": job_id, "event": "▶ started"})
+    stoprequest.clear()  # A stop meant for an encode that already finished must not stop this one
+    encode_running.set()
+    start_time = time.time()
+    startupinfo = None
+    if os.name == "nt":  # Workers may run on other platforms, where there is no console window to hide
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    process = subprocess.Popen(command, startupinfo=startupinfo, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, close_fds=True)
+    # Print output as it arrives
+    print("Processing...")
+
+    # We want to print the initial information from the encoder before we start capturing encode stats
+    msg = ""
+    for line in process.stdout:
+        string = r"{}".format(line)
+        if string[:3] == "fra":
+            break
+        else:
+            msg += "{}\n".format(line.strip())
+    # The banner is kept in the log of the job instead of flooding the main log
+    log.job(job_id, msg)
+    gui_queue.put("START ENCODE VIDEO")
+
+    # Once the initial information has been fetched we can start updating the status box
+    # It is not super important for this information to be exactly realtime. It only fetches the latest output line each iteration
+    # and the status deque only holds the latest line, so there is no actual queue waiting.
+    while True:
+        if stoprequest.is_set():
+            gui_queue.put("Reiceived kill signal, stopping...")
+            process.kill()
+            break
+
+        line = process.stdout.readline()
+        if line == '' and process.poll() is not None:
+            break
+        if not line[:3] == "fra":
+            log.job(job_id, line)
+            break
+        if line:
+            split = re.split("frame=|fps=|q=|size=|time=", line)  # index 1 = frame, 2 = fps, 3 = q, 4 = size  TODO: investigate instances when the 'q=' split ends with 'L' forming Lsize?
+
+            percent_done = float(0)  # (and est_size) Initialized as a string, in case we are unable to calculate percent done
+            est_size = float(0)
+            done_frames = int(split[1])
+            time_to_complete = ""
+
+            # TODO: only change total_frames in if-elif, the rest can be outside
+            if total_frames:
+                # print("{} of {}".format(done_frames, total_frames))
+                percent_done = 100 - (((total_frames - done_frames) / total_frames) * 100)
+
+                # print("frames:", total_frames, " done f:", done_frames, "hm:", (time.time() - start_time))
+
+                time_to_complete = format_seconds((total_frames - done_frames) * (time.time() - start_time) / (1 if done_frames == 0 else done_frames))
+                # progressbar.UpdateBar(done_frames, max=total_frames)
+
+            if type(percent_done) is not str and percent_done > 0:
+                cur_size = int(split[4].replace("kB", ""))
+                est_size = ((cur_size * 100) / percent_done) / 1024  # size in MiB
+
+            formatted_time, seconds = calc_time(start_time, time.time())
+            status_deque.append("frame: {}/{} | fps: {} | done: {:.1f}% | est. size: {:.2f} | elapsed: {} | time: {}".format(split[1], total_frames, split[2], percent_done, est_size, formatted_time, time_to_complete))
+
+    # Make sure ffmpeg has finished writing the file before it is handed over for analysis
+    log.job(job_id, process.stdout.read())
+    process.wait()
+    cancelled = stoprequest.is_set()
+
+    end_string = '** Finished encode of {}.\nDuration: {}\n{} frames **'.format(params["title"], calc_time(start_time, time.time())[0], done_frames)
+
+    encode_running.clear()
+    stoprequest.clear()
+
+    encode_event.put({"uuid": job_id, "event": "✓ finished"})
+    gui_queue.put(end_string)  # put a message into queue for GUI
+    status_deque.append(end_string)  # Put a message in status box
+    log.job(job_id, end_string)
+
+    return done_frames, cancelled
+
+
+def take_job(job):
+    """Mark a job from the encode queue as started, so it is not queued again or taken by another encode worker.
+
+    :param job: (dict) the job, as it is stored in the encode list
+    :return: False if the job was already taken
+    """
+    with take_lock:
+        if job["status"] != "⏱ waiting":
+            return False
+        job["status"] = "▶ started"
+        return True
+
+
+def wake_encode_consumers(encode_queue, dispatcher=None):
+    """Put a _skip in the encode queue for the encode thread and for each encode worker, so they all see a pause
+
+    :param encode_queue: (queue.Queue) the encode queue
+    :param dispatcher: (Dispatcher) the dispatcher, if encode workers are enabled
+    """
+    for _ in range(1 + (dispatcher.consumer_count() if dispatcher else 0)):
+        encode_queue.put(_skip)
+
+
+def encode_thread(encode_queue, gui_queue, status_deque, encode_event, analysis_queue, log):
     """A worker thread that communicates with the GUI through queues.
 
     The thread will wait for the encode_queue to deliver encode params. This way multiple jobs can be queued.
@@ -100,6 +389,8 @@ def encode_thread(encode_queue, gui_queue, status_deque, encode_event):
     :param status_deque: (collections.deque) Deque used for updating stats during encode
     :param encode_queue: (queue.Queue) Queue which is eventually populated with dicts containing data for starting encodes
     :param encode_event: (queue.Queue) Queue which lets the thread send an event when a job starts and finishes
+    :param analysis_queue: (queue.Queue) Queue where finished jobs are handed over to the analysis pool
+    :param log: (LogStore) Log where the output from ffmpeg is kept for each job
     :return:
     """
     print("Encode thread initialized")
@@ -112,110 +403,864 @@ def encode_thread(encode_queue, gui_queue, status_deque, encode_event):
             break
         if params is _skip:  # This lets us skip one turn so we can pause the queue using the threading event
             continue
+        if not take_job(params):
+            continue
 
-        # todo: are we sure the values in the dict are always there?
-        command = params["command"]
-        test_encode = params["test_encode"]
-        metadata = params["metadata"]
-        job_id = params["uuid"]
-        output_file = params["output_file"]
-        total_frames = test_encode if test_encode else int(metadata["frame_count"])  # This could still result in None
+        try:
+            done_frames, cancelled = run_encode(params, gui_queue, status_deque, encode_event, log)
+        except Exception as e:  # Keep the thread alive for the rest of the queue
+            encode_running.clear()
+            stoprequest.clear()
+            encode_event.put({"uuid": params["uuid"], "event": "❌ failed"})
+            gui_queue.put("Encode of {} failed: {}".format(params["title"], e))
+            continue
 
-        done_frames = 0
+        # Analysis is left to the analysis pool so we can start the next encode right away
+        analysis_queue.put(dict(params, done_frames=done_frames, cancelled=cancelled))
 
-        print('Starting encode of ' + params["title"] + " - " + job_id)
-        encode_event.put({"uuid": job_id, "event": "▶ started"})
-        encode_running.set()
-        start_time = time.time()
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        process = subprocess.Popen(command, startupinfo=startupinfo, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, close_fds=True)
-        # Print output as it arrives
-        print("Processing...")
-
-        # We want to print the initial information from the encoder before we start capturing encode stats
-        msg = ""
-        for line in process.stdout:
-            string = r"{}".format(line)
-            if string[:3] == "fra":
-                break
-            else:
-                msg += "{}\n".format(line.strip())
-        # Collect the previous lines in one var and then print through queue,
-        # if we don't the output element will try to print two lines at the same time and crash... I think...
-        # gui_queue.put(msg)
-        gui_queue.put("START ENCODE VIDEO")
-
-        # Once the initial information has been fetched we can start updating the status box
-        # It is not super important for this information to be exactly realtime. It only fetches the latest output line each iteration
-        # and the status deque only holds the latest line, so there is no actual queue waiting.
+
+def parse_timestamp(timestamp):
+    """Convert a timestamp like HH:MM:SS.mmm into seconds
+
+    :param timestamp: (str) the timestamp. Plain seconds and MM:SS are also accepted
+    :return: the amount of seconds as a float, or None if the timestamp is empty or malformed
+    """
+    if not timestamp:
+        return None
+    try:
+        seconds = 0.0
+        for part in str(timestamp).split(":"):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def expected_frames(job):
+    """Calculate how many frames an encode job should produce, taking test encodes and start/end time into account
+
+    :param job: (dict) the job as it is stored in the encode list
+    :return: the expected amount of frames, or None if it can not be calculated
+    """
+    metadata = job["metadata"]
+    fps = float(metadata["fps"]) if metadata["fps"] else None
+    start = parse_timestamp(job.get("start_time")) or 0
+    end = parse_timestamp(job.get("end_time"))
+    if end is not None and end <= start:  # Nothing sensible to expect, ffmpeg will not encode anything either
+        return None
+
+    frames = int(metadata["frame_count"]) if metadata["frame_count"] else None
+    if fps and end:
+        frames = round((end - start) * fps)
+    elif fps and frames:
+        frames -= round(start * fps)
+    if frames is not None and frames <= 0:
+        return None
+
+    if job["test_encode"]:
+        return min(job["test_encode"], frames) if frames else job["test_encode"]
+    return frames
+
+
+def probe_output(ffmpeg_path, file_path):
+    """Count the frames and bytes of the video stream in a file by remuxing it to nowhere.
+
+    Mediainfo reports the statistics tags that ffmpeg copies over from the source, which gives the wrong track size,
+    so we let ffmpeg read the actual packets instead. Nothing is decoded, so this is about as fast as reading the file.
+
+    :param ffmpeg_path: (pathlib.Path) the filepath to the ffmpeg executable
+    :param file_path: (pathlib.Path) the file to probe
+    :return: a dict with the frame count, the stream size in MiB and the duration in seconds. Values are None if not found
+    """
+    command = [ffmpeg_path.absolute().as_posix(), "-hide_banner", "-i", str(file_path), "-map", "0:v:0", "-c", "copy", "-f", "null", "-"]
+    process = subprocess.run(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+    frames = re.findall(r"frame=\s*(\d+)", process.stdout)
+    size = re.findall(r"video:\s*(\d+)(?:kB|KiB)", process.stdout)
+    duration = re.findall(r"time=\s*(\d+:\d+:[\d.]+)", process.stdout)
+    return {
+        "frames": int(frames[-1]) if frames else None,
+        "size": int(size[-1]) / 1024 if size else None,  # in MiB
+        "duration": parse_timestamp(duration[-1]) if duration else None,
+    }
+
+
+def measure_segment(ffmpeg_path, job, offset, length):
+    """Calculate SSIM and PSNR for one segment of an encode, compared to the same segment of the source.
+
+    The crop of the job is applied to the source so the frames line up, other filters like sharpening are not,
+    since they are part of what we want to measure.
+
+    :param ffmpeg_path: (pathlib.Path) the filepath to the ffmpeg executable
+    :param job: (dict) the job as it is stored in the encode list
+    :param offset: (float) where the segment starts in the encoded file, in seconds
+    :param length: (float) the length of the segment in seconds
+    :return: a tuple of (ssim, psnr), either may be None if ffmpeg did not report it
+    """
+    source_offset = offset + (parse_timestamp(job.get("start_time")) or 0)
+    reference_filters = ",".join(filter(None, [job.get("crop"), "setpts=PTS-STARTPTS"]))
+    graph = "[0:v]setpts=PTS-STARTPTS,split[d1][d2];[1:v]{},split[r1][r2];[d1][r1]ssim;[d2][r2]psnr".format(reference_filters)
+
+    command = [ffmpeg_path.absolute().as_posix(), "-hide_banner", "-ss", str(offset), "-t", str(length), "-i", str(job["output_file"]),
+               "-ss", str(source_offset), "-t", str(length), "-i", str(job["input_file"]), "-lavfi", graph, "-f", "null", "-"]
+    process = subprocess.run(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+    ssim = re.search(r"SSIM .*All:([\d.]+)", process.stdout)
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", process.stdout)
+    return float(ssim.group(1)) if ssim else None, float(psnr.group(1)) if psnr else None
+
+
+def measure_quality(ffmpeg_path, job, duration):
+    """Sample SSIM and PSNR on segments spread out over the encode. The segments are measured in parallel.
+
+    :param ffmpeg_path: (pathlib.Path) the filepath to the ffmpeg executable
+    :param job: (dict) the job as it is stored in the encode list
+    :param duration: (float) the duration of the encoded file in seconds
+    :return: a dict with the average ssim and psnr of the segments, None if they could not be measured
+    """
+    length = min(METRIC_SEGMENT_LENGTH, duration)
+    offsets = [(duration - length) * (i + 0.5) / METRIC_SEGMENTS for i in range(METRIC_SEGMENTS)]
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=METRIC_SEGMENTS) as pool:
+        results = list(pool.map(lambda offset: measure_segment(ffmpeg_path, job, offset, length), offsets))
+
+    ssims = [ssim for ssim, psnr in results if ssim is not None]
+    psnrs = [psnr for ssim, psnr in results if psnr is not None]
+    return {
+        "ssim": sum(ssims) / len(ssims) if ssims else None,
+        "psnr": sum(psnrs) / len(psnrs) if psnrs else None,
+    }
+
+
+def analyze_encode(ffmpeg_path, job):
+    """Check the result of a finished encode against the source.
+
+    :param ffmpeg_path: (pathlib.Path) the filepath to the ffmpeg executable
+    :param job: (dict) the finished job, with done_frames and cancelled added by the encode thread
+    :return: a dict with the results, which is attached to the job in the encode list
+    """
+    output = probe_output(ffmpeg_path, job["output_file"])
+    analysis = {
+        "frames": output["frames"],
+        "expected_frames": expected_frames(job),
+        "frames_match": None,
+        "cancelled": job["cancelled"],
+        "size": output["size"],
+        "source_size": job["metadata"]["size"],
+        "ssim": None,
+        "psnr": None,
+    }
+
+    # A stopped encode is short on purpose, so there is no point in checking its frame count
+    if analysis["frames"] is not None and analysis["expected_frames"] and not job["cancelled"]:
+        analysis["frames_match"] = abs(analysis["frames"] - analysis["expected_frames"]) <= FRAME_TOLERANCE
+
+    # Compare with the part of the source that was actually encoded, not the whole file
+    source_frames = job["metadata"]["frame_count"]
+    if analysis["source_size"] and source_frames and analysis["expected_frames"]:
+        analysis["source_size"] *= min(1, analysis["expected_frames"] / int(source_frames))
+
+    if job.get("quality_metrics") and not job["cancelled"] and output["duration"]:
+        analysis.update(measure_quality(ffmpeg_path, job, output["duration"]))
+
+    return analysis
+
+
+def format_analysis(job, analysis):
+    """Create a readable summary of the analysis of a job"""
+    lines = ["** Analysis of {} **".format(job["title"])]
+    if analysis["size"] is not None:
+        if analysis["source_size"]:
+            diff = analysis["source_size"] - analysis["size"]
+            lines.append("Final size: {:.2f} MB, saving {:.2f} MB. A size reduction of {:.2f}%".format(analysis["size"], diff, (diff / analysis["source_size"]) * 100))
+        else:
+            lines.append("Final size: {:.2f} MB".format(analysis["size"]))
+    if analysis["cancelled"]:
+        lines.append("Encode was stopped after {} frames".format(analysis["frames"]))
+    elif analysis["frames_match"] is False:
+        lines.append("Frame count mismatch! Encoded {} frames, expected {}".format(analysis["frames"], analysis["expected_frames"]))
+    elif analysis["frames_match"]:
+        lines.append("Frame count OK ({} frames)".format(analysis["frames"]))
+    if analysis["ssim"] is not None:
+        lines.append("SSIM: {:.4f}".format(analysis["ssim"]))
+    if analysis["psnr"] is not None:
+        lines.append("PSNR: {:.2f} dB".format(analysis["psnr"]))
+    return "\n".join(lines)
+
+
+def analysis_thread(analysis_queue, gui_queue, encode_event, ffmpeg_path):
+    """A worker thread in the post-encode analysis pool.
+
+    The encode thread hands over finished jobs through the analysis_queue so it can start the next encode right away.
+    Results are sent back as an encode event, which the GUI attaches to the job.
+
+    :param analysis_queue: (queue.Queue) Queue which is populated with finished jobs
+    :param gui_queue: (queue.Queue) Queue to communicate results back to GUI
+    :param encode_event: (queue.Queue) Queue for sending the analysis results of a job
+    :param ffmpeg_path: (pathlib.Path) the filepath to the ffmpeg executable
+    """
+    while True:
+        job = analysis_queue.get()
+        if job is _sentinel:
+            break
+
+        try:
+            analysis = analyze_encode(ffmpeg_path, job)
+        except Exception as e:
+            gui_queue.put("Could not analyze {}: {}".format(job["title"], e))
+            continue
+        finally:
+            analysis_queue.task_done()  # Lets calibration wait for the pool to go idle
+
+        encode_event.put({"uuid": job["uuid"], "analysis": analysis})
+        gui_queue.put(format_analysis(job, analysis))
+
+
+def max_preset(width, height):
+    """Find the fastest preset SVT-HEVC allows at a resolution.
+
+    Presets 10 and up need 1080p or more, and 11 and 12 need 4k. Cropped video counts as the cropped resolution.
+
+    :param width: (int) width of the encoded video
+    :param height: (int) height of the encoded video
+    :return: the highest preset number allowed
+    """
+    pixels = width * height
+    if pixels >= PIXELS_4K:
+        return 12
+    elif pixels >= PIXELS_1080P:
+        return 10
+    return 9
+
+
+def output_resolution(width, height, crop):
+    """Get the resolution of the encoded video, taking the crop filter into account
+
+    :param crop: (str) the crop filter, like crop=1920:800:0:140, or an empty string
+    :return: a tuple of (width, height)
+    """
+    match = re.match(r"crop=(\d+):(\d+)", crop or "")
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    return int(width), int(height)
+
+
+def calibration_thread(ffmpeg_path, reference, metadata, gui_queue, profile_path, analysis_queue=None):
+    """Encode a short clip across presets and QPs, and save the speed, bitrate and quality of each as the profile of this machine.
+
+    The clip is taken from a quarter into the reference file. Stop encode aborts the calibration between runs.
+
+    :param ffmpeg_path: (pathlib.Path) the filepath to the ffmpeg executable
+    :param reference: (pathlib.Path) the video file to take the clip from
+    :param metadata: (dict) metadata of the reference, as gathered by the GUI
+    :param gui_queue: (queue.Queue) Queue for reporting progress back to the GUI
+    :param profile_path: (pathlib.Path) where to save the profile
+    :param analysis_queue: (queue.Queue) the queue of the analysis pool, which has to be empty so it does not slow down the measurements
+    """
+    import tempfile
+    calibration_running.set()
+    stoprequest.clear()
+    try:
+        if analysis_queue is not None and analysis_queue.unfinished_tasks:
+            gui_queue.put("Waiting for the analysis of finished encodes before calibrating...")
+            analysis_queue.join()
+        try:
+            fps = float(metadata["fps"])
+            start = (metadata["duration"] or 0) / 4000  # duration is in ms
+            width, height = int(metadata["width"]), int(metadata["height"])
+        except (TypeError, ValueError):
+            gui_queue.put("Can not calibrate, the resolution or framerate of the input is unknown")
+            return
+        profile = {"host": platform.node(), "cpu_count": os.cpu_count(), "width": width, "height": height, "frames": CALIBRATION_FRAMES, "results": []}
+        clip = {"output_file": Path(tempfile.gettempdir()) / "svt_gui_calibration.mkv", "input_file": reference, "start_time": str(start), "crop": ""}
+
+        gui_queue.put("Calibrating presets on {}x{}, this will take a while...".format(width, height))
+        for preset in [i for i in CALIBRATION_PRESETS if i <= max_preset(width, height)]:
+            for qp in CALIBRATION_QPS:
+                if stoprequest.is_set():
+                    stoprequest.clear()
+                    gui_queue.put("Calibration stopped, the profile was not saved")
+                    return
+
+                command = [ffmpeg_path.absolute().as_posix(), "-hide_banner", "-y", "-ss", str(start), "-i", str(reference), "-map", "0:v:0",
+                           "-frames:v", str(CALIBRATION_FRAMES), "-c:v", "libsvt_hevc", "-rc", "0", "-qp", str(qp), "-preset", str(preset), str(clip["output_file"])]
+                if clip["output_file"].exists():
+                    clip["output_file"].unlink()  # Left over from a calibration that crashed
+                start_time = time.time()
+                process = subprocess.run(command, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL)
+                elapsed = time.time() - start_time
+
+                if process.returncode != 0 or not clip["output_file"].exists():
+                    gui_queue.put("Calibration encode failed for preset {}, QP {}".format(preset, qp))
+                    continue
+
+                ssim, psnr = measure_segment(ffmpeg_path, clip, 0, CALIBRATION_FRAMES / fps)
+                result = {
+                    "preset": preset,
+                    "qp": qp,
+                    "fps": CALIBRATION_FRAMES / elapsed,
+                    "bitrate": clip["output_file"].stat().st_size * 8 / (CALIBRATION_FRAMES / fps) / 1000,  # in kbps
+                    "ssim": ssim,
+                }
+                profile["results"].append(result)
+                clip["output_file"].unlink()
+                gui_queue.put("Preset {} ({}), QP {}: {:.1f} fps, {:.0f} kbps, SSIM {}".format(preset, PRESETS[preset], qp, result["fps"], result["bitrate"], ssim))
+
+        if not profile["results"]:
+            gui_queue.put("Calibration failed, no presets could be encoded")
+            return
+        write_settings(profile_path, profile)
+        gui_queue.put("Calibration done, saved profile to {}".format(profile_path.absolute()))
+    finally:
+        calibration_running.clear()
+
+
+def pareto_frontier(results):
+    """Keep only the calibration results that no other result beats on both speed and bitrate"""
+    def dominates(other, result):
+        return other["fps"] >= result["fps"] and other["bitrate"] <= result["bitrate"] and (other["fps"] > result["fps"] or other["bitrate"] < result["bitrate"])
+
+    return [result for result in results if not any(dominates(other, result) for other in results)]
+
+
+def advise_preset(profile, width, height, frames, deadline, qp):
+    """Recommend the preset that gives the smallest file while still finishing the encode before the deadline.
+
+    Speeds measured during calibration are scaled by pixel count to the resolution of the input,
+    and presets SVT-HEVC does not allow at that resolution are left out.
+
+    :param profile: (dict) the calibration profile of this machine
+    :param width: (int) width of the encoded video
+    :param height: (int) height of the encoded video
+    :param frames: (int) how many frames will be encoded
+    :param deadline: (float) how many seconds the encode may take
+    :param qp: (int) the QP that will be used. Results for the nearest calibrated QP are used
+    :return: a tuple of (preset, explanation). The preset is None if no calibrated preset is allowed
+    """
+    nearest_qp = min({result["qp"] for result in profile["results"]}, key=lambda i: abs(i - qp))
+    scale = (profile["width"] * profile["height"]) / (width * height)  # Encode speed roughly follows the pixel count
+    candidates = [dict(result, fps=result["fps"] * scale) for result in profile["results"]
+                  if result["qp"] == nearest_qp and result["preset"] <= max_preset(width, height)]
+    if not candidates:
+        return None, "None of the calibrated presets are allowed at {}x{}".format(width, height)
+
+    needed_fps = frames / deadline
+    frontier = pareto_frontier(candidates)
+    fast_enough = [result for result in frontier if result["fps"] >= needed_fps]
+    if not fast_enough:
+        best = max(frontier, key=lambda result: result["fps"])
+        return best["preset"], "No preset is fast enough, {:.1f} fps is needed. The fastest allowed preset is {} ({}) at about {:.1f} fps".format(
+            needed_fps, best["preset"], PRESETS[best["preset"]], best["fps"])
+
+    best = min(fast_enough, key=lambda result: (result["bitrate"], -(result["ssim"] or 0)))
+    return best["preset"], "Preset {} ({}) should encode at about {:.1f} fps ({:.1f} fps needed), at around {:.0f} kbps".format(
+        best["preset"], PRESETS[best["preset"]], best["fps"], needed_fps, best["bitrate"] / scale)
+
+
+class KeyframeIndex:
+    """Keyframe timestamps and scene change scores of a video file, read from a memory-mapped cache file.
+
+    The cache file is a header with the length of each array, followed by the keyframe times, the scene change times
+    and the scene change scores as doubles. All times are in seconds from the start of the file.
+    """
+
+    def __init__(self, index_path):
+        """
+        :param index_path: (pathlib.Path) the cache file written by build_keyframe_index
+        """
+        import mmap
+        import struct
+        with index_path.open("rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        counts = struct.unpack_from(INDEX_HEADER, self._mmap)
+        arrays = []
+        offset = struct.calcsize(INDEX_HEADER)
+        for count in counts:
+            arrays.append(memoryview(self._mmap)[offset:offset + count * 8].cast("d"))
+            offset += count * 8
+        self.keyframes, self.scene_times, self.scene_scores = arrays
+
+    def keyframe_before(self, seconds):
+        """Get the last keyframe at or before a time, or None if there is none"""
+        i = bisect_right(self.keyframes, seconds)
+        return self.keyframes[i - 1] if i else None
+
+    def keyframe_after(self, seconds):
+        """Get the first keyframe at or after a time, or None if there is none"""
+        i = bisect_left(self.keyframes, seconds)
+        return self.keyframes[i] if i < len(self.keyframes) else None
+
+    def nearest_keyframe(self, seconds, start=0.0, end=None, exclude=()):
+        """Get the keyframe closest to a time, between start and end and not in exclude. None if there is none"""
+        end = float("inf") if end is None else end
+        # Walk outwards from the time, within the keyframes lo to hi that are between start and end
+        lo = bisect_left(self.keyframes, start)
+        hi = bisect_right(self.keyframes, end)
+        before = min(bisect_right(self.keyframes, seconds), hi) - 1
+        after = max(before + 1, lo)
         while True:
-            if stoprequest.isSet():
-                gui_queue.put("Reiceived kill signal, stopping...")
-                process.kill()
-                break
+            candidates = [j for j in (before, after) if lo <= j < hi]
+            if not candidates:
+                return None
+            best = min(candidates, key=lambda j: abs(self.keyframes[j] - seconds))
+            if best == before:
+                before -= 1
+            else:
+                after += 1
+            if self.keyframes[best] not in exclude:
+                return self.keyframes[best]
+
+    def scene_cut_near(self, seconds, tolerance=SCENE_SAFE_TOLERANCE):
+        """Get the scene change closest to a time, or None if there is none within the tolerance"""
+        i = bisect_left(self.scene_times, seconds)
+        near = [self.scene_times[j] for j in (i - 1, i) if 0 <= j < len(self.scene_times) and abs(self.scene_times[j] - seconds) <= tolerance]
+        return min(near, key=lambda cut: abs(cut - seconds)) if near else None
+
+    def scene_safe_points(self, n, start=0.0, end=None):
+        """Get up to n evenly spaced keyframes between start and end, which can be used for seeking or for splitting the file.
+
+        Each point is moved to the keyframe closest to a nearby scene change if there is one, so splits don't land in
+        the middle of a scene. If that keyframe is already used, the keyframe closest to the point is used instead.
+
+        :param n: (int) the number of points wanted. Fewer are returned if there are not enough keyframes
+        :param start: (float) where the first part starts, in seconds
+        :param end: (float) where the last part ends, in seconds. Defaults to the last keyframe
+        :return: a sorted list of keyframe times
+        """
+        if not len(self.keyframes):
+            return []
+        end = self.keyframes[-1] if end is None else end
+
+        points = []
+        for i in range(n):
+            target = start + (end - start) * (i + 1) / (n + 1)
+            cut = self.scene_cut_near(target)
+            keyframe = self.nearest_keyframe(cut, start, end) if cut is not None else None
+            if keyframe is None or keyframe in points:
+                keyframe = self.nearest_keyframe(target, start, end, points)
+            if keyframe is not None:
+                points.append(keyframe)
+        return sorted(points)
+
+
+def index_path(file_path, cache_dir=INDEX_CACHE):
+    """Get the path of the cached index of a file.
+
+    The file is identified by its path, size and modification time, so a changed file gets a new index.
+    """
+    import hashlib
+    stat = file_path.stat()
+    identity = "{}|{}|{}".format(file_path.resolve(), stat.st_size, stat.st_mtime_ns)
+    return cache_dir / (hashlib.sha1(identity.encode("utf-8")).hexdigest() + ".idx")
+
+
+def load_keyframe_index(file_path, cache_dir=INDEX_CACHE):
+    """Load the cached index of a file
+
+    :return: a KeyframeIndex, or None if the file has not been indexed
+    """
+    path = index_path(file_path, cache_dir)
+    return KeyframeIndex(path) if path.exists() else None
+
+
+def build_keyframe_index(ffmpeg_path, file_path, scenes=False, cache_dir=INDEX_CACHE):
+    """Index the keyframes, and optionally the scene changes, of the first video stream of a file in one read.
+
+    Keyframes come from the packet flags of a stream copy to the framecrc muxer, so nothing has to be decoded.
+    Scene changes need decoding, so they are detected on a downscaled copy in a second output of the same ffmpeg process.
+
+    :param ffmpeg_path: (pathlib.Path) the filepath to the ffmpeg executable
+    :param file_path: (pathlib.Path) the video file to index
+    :param scenes: (bool) whether to detect scene changes as well
+    :param cache_dir: (pathlib.Path) the folder to store the index in
+    :return: the KeyframeIndex
+    """
+    import struct
+    import tempfile
+    command = [ffmpeg_path.absolute().as_posix(), "-hide_banner", "-nostats", "-i", str(file_path), "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"]
+    if scenes:
+        command += ["-map", "0:v:0", "-vf", "scale=320:-2,select='gt(scene,{})',metadata=print".format(SCENE_THRESHOLD), "-f", "null", "-"]
+    process = subprocess.Popen(command, stdin=DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE if scenes else DEVNULL,
+                               universal_newlines=True, close_fds=True)
+
+    scene_times = array("d")
+    scene_scores = array("d")
+
+    def read_scenes():
+        # metadata=print logs the time of each selected frame, followed by its scene score
+        frame_time = None
+        for line in process.stderr:
+            match = re.search(r"pts_time:\s*([\d.]+)", line)
+            if match:
+                frame_time = float(match.group(1))
+            match = re.search(r"lavfi\.scene_score=([\d.]+)", line)
+            if match and frame_time is not None:
+                scene_times.append(frame_time)
+                scene_scores.append(float(match.group(1)))
+
+    scene_reader = threading.Thread(target=read_scenes, daemon=True)
+    if scenes:
+        scene_reader.start()
+
+    # Non-key packets are marked with F=0x0, keyframes have no flags listed
+    keyframes = array("d")
+    time_base = 1.0
+    for line in process.stdout:
+        if line.startswith("#tb 0:"):
+            num, den = line.split(":")[1].split("/")
+            time_base = int(num) / int(den)
+        elif line.startswith("0,") and "F=" not in line:
+            fields = line.split(",")
+            pts = int(fields[2]) if int(fields[2]) != NOPTS_VALUE else int(fields[1])
+            keyframes.append(pts * time_base)
+    process.wait()
+    if scenes:
+        scene_reader.join()
+
+    keyframes = array("d", sorted(keyframes))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = index_path(file_path, cache_dir)
+    # The same file can be indexed twice at the same time, so each build writes its own temp file
+    with tempfile.NamedTemporaryFile(dir=str(cache_dir), suffix=".tmp", delete=False) as file:
+        file.write(struct.pack(INDEX_HEADER, len(keyframes), len(scene_times), len(scene_scores)))
+        keyframes.tofile(file)
+        scene_times.tofile(file)
+        scene_scores.tofile(file)
+    try:
+        os.replace(file.name, str(path))
+    except OSError:
+        # On Windows an index that is already mapped can not be replaced, but then the other build got there first
+        os.remove(file.name)
+        if not path.exists():
+            raise
+    return KeyframeIndex(path)
+
+
+def index_thread(ffmpeg_path, file_path, scenes, gui_queue):
+    """Index a file in the background, unless it is already cached
+
+    :param gui_queue: (queue.Queue) Queue for reporting back to the GUI
+    """
+    try:
+        if load_keyframe_index(file_path) is None:
+            index = build_keyframe_index(ffmpeg_path, file_path, scenes)
+            gui_queue.put("Indexed {}: {} keyframes, {} scene changes".format(file_path.name, len(index.keyframes), len(index.scene_times)))
+    except Exception as e:
+        gui_queue.put("Could not index {}: {}".format(file_path.name, e))
+
+
+def close_connection(connection):
+    """Close a connection, and wake up any thread that is waiting to read from it"""
+    import socket
+    try:
+        connection.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    connection.close()
+
+
+def send_message(connection, lock, message):
+    """Send a message as a line of json. Returns False if the connection is gone
+
+    :param connection: (socket.socket) the connection to send on
+    :param lock: (threading.Lock) lock that stops several threads from writing at the same time
+    :param message: (dict) the message
+    """
+    try:
+        with lock:
+            connection.sendall((json.dumps(message, default=str) + "\n").encode("utf-8"))
+        return True
+    except OSError:
+        return False
+
+
+class DispatcherChannel:
+    """Stands in for the queues, the status deque and the log that run_encode reports to, and forwards everything to the dispatcher"""
+
+    def __init__(self, send, kind):
+        """
+        :param send: (function) sends a message to the dispatcher
+        :param kind: (str) the message type used for put and append
+        """
+        self.send = send
+        self.kind = kind
+
+    def put(self, item):
+        self.send({"type": self.kind, "data": item})
+
+    def append(self, item):
+        self.put(item)
+
+    def job(self, job_id, text):
+        self.send({"type": "log", "uuid": job_id, "data": text})
+
+
+class Dispatcher:
+    """Hands jobs from the encode queue to encode workers on other machines, see worker_main.
+
+    Workers connect over TCP and take one job at a time from the same queue as the local encode thread.
+    Everything a worker sends renews the lease on its job. If the lease expires or the connection drops,
+    the job is marked as waiting again, and the GUI puts it back in its place in the queue.
+    """
 
-            line = process.stdout.readline()
-            if line == '' and process.poll() is not None:
+    def __init__(self, port, encode_queue, gui_queue, status_deque, encode_event, analysis_queue, log):
+        """
+        :param port: (int) the TCP port to listen for workers on, 0 picks a free port
+        The queues, deque and log are the same ones the local encode thread uses, see encode_thread
+        """
+        self.port = port
+        self.encode_queue = encode_queue
+        self.gui_queue = gui_queue
+        self.status_deque = status_deque
+        self.encode_event = encode_event
+        self.analysis_queue = analysis_queue
+        self.log = log
+        self.workers = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.server = None
+
+    def start(self):
+        """Start listening for workers"""
+        import socket
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("", self.port))
+        self.port = self.server.getsockname()[1]
+        self.server.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+        threading.Thread(target=self._expire_leases, daemon=True).start()
+        print("Listening for encode workers on port {}".format(self.port))
+
+    def stop(self):
+        """Stop listening and disconnect all workers. Jobs running on workers are stopped"""
+        self.stopped.set()
+        if self.server:
+            self.server.close()
+        with self.lock:
+            for worker in self.workers:
+                close_connection(worker["connection"])
+
+    def consumer_count(self):
+        """Get the number of workers taking jobs from the encode queue"""
+        with self.lock:
+            return len(self.workers)
+
+    def cancel_all(self):
+        """Stop the encodes running on all workers"""
+        with self.lock:
+            for worker in self.workers:
+                if worker["job"]:
+                    send_message(worker["connection"], worker["send_lock"], {"type": "cancel", "uuid": worker["job"]["uuid"]})
+
+    def _accept(self):
+        while not self.stopped.is_set():
+            try:
+                connection, address = self.server.accept()
+            except OSError:
                 break
-            if not line[:3] == "fra":
+            threading.Thread(target=self._serve, args=(connection, address), daemon=True).start()
+
+    def _serve(self, connection, address):
+        """Read the messages from one worker until it disconnects"""
+        worker = {"name": "{}:{}".format(*address), "connection": connection, "send_lock": threading.Lock(), "job": None,
+                  "lease": time.time() + LEASE_TIMEOUT, "idle": threading.Event(), "alive": True}
+        with self.lock:
+            self.workers.append(worker)
+        threading.Thread(target=self._assign, args=(worker,), daemon=True).start()
+
+        try:
+            for line in connection.makefile("r", encoding="utf-8"):
+                message = json.loads(line)
+                worker["lease"] = time.time() + LEASE_TIMEOUT
+                if not isinstance(message, dict) or not self._handle(worker, message):
+                    self.gui_queue.put("Ignored a bad message from encode worker {}: {}".format(worker["name"], line.strip()[:200]))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._drop(worker)
+
+    def _handle(self, worker, message):
+        """Act on a message from a worker
+
+        :return: False if the message is missing something
+        """
+        kind = message.get("type")
+        data = message.get("data")
+        if kind == "register" and "name" in message:
+            worker["name"] = str(message["name"])
+            worker["idle"].set()
+            self.gui_queue.put("Encode worker {} connected".format(worker["name"]))
+        elif kind == "heartbeat":
+            pass
+        elif kind == "message" and data is not None:
+            self.gui_queue.put("[{}] {}".format(worker["name"], data))
+        elif kind == "status" and data is not None:
+            self.status_deque.append("[{}] {}".format(worker["name"], data))
+        elif kind == "event" and isinstance(data, dict) and "uuid" in data and "event" in data:
+            self.encode_event.put({"uuid": data["uuid"], "event": data["event"]})
+        elif kind == "log" and "uuid" in message and isinstance(data, str):
+            self.log.job(message["uuid"], data)
+        elif kind in ("done", "failed") and "uuid" in message:
+            with self.lock:
+                job = worker["job"]
+                if job and job["uuid"] == message["uuid"]:
+                    worker["job"] = None
+            if job and job["uuid"] == message["uuid"]:
+                if kind == "done":
+                    self.analysis_queue.put(dict(job, done_frames=message.get("done_frames", 0), cancelled=bool(message.get("cancelled"))))
+                else:
+                    self.encode_event.put({"uuid": job["uuid"], "event": "❌ failed"})
+                    self.gui_queue.put("Encode of {} failed on {}: {}".format(job["title"], worker["name"], message.get("error")))
+                worker["idle"].set()
+        else:
+            return False
+        return True
+
+    def _assign(self, worker):
+        """Give the worker a job from the encode queue whenever it is idle"""
+        while True:
+            worker["idle"].wait()
+            if not worker["alive"] or self.stopped.is_set():
                 break
-            if line:
-                split = re.split("frame=|fps=|q=|size=|time=", line)  # index 1 = frame, 2 = fps, 3 = q, 4 = size  TODO: investigate instances when the 'q=' split ends with 'L' forming Lsize?
-
-                percent_done = float(0)  # (and est_size) Initialized as a string, in case we are unable to calculate percent done
-                est_size = float(0)
-                done_frames = int(split[1])
-                time_to_complete = ""
-
-                # TODO: only change total_frames in if-elif, the rest can be outside
-                if total_frames:
-                    # print("{} of {}".format(done_frames, total_frames))
-                    percent_done = 100 - (((total_frames - done_frames) / total_frames) * 100)
-
-                    # print("frames:", total_frames, " done f:", done_frames, "hm:", (time.time() - start_time))
-
-                    time_to_complete = format_seconds((total_frames - done_frames) * (time.time() - start_time) / (1 if done_frames == 0 else done_frames))
-                    # progressbar.UpdateBar(done_frames, max=total_frames)
-
-                if type(percent_done) is not str and percent_done > 0:
-                    cur_size = int(split[4].replace("kB", ""))
-                    est_size = ((cur_size * 100) / percent_done) / 1024  # size in MiB
-
-                formatted_time, seconds = calc_time(start_time, time.time())
-                status_deque.append("frame: {}/{} | fps: {} | done: {:.1f}% | est. size: {:.2f} | elapsed: {} | time: {}".format(split[1], total_frames, split[2], percent_done, est_size, formatted_time, time_to_complete))
-
-        size_analysis = ""
-        media_info = MediaInfo.parse(str(output_file.absolute()))
-        for track in media_info.tracks:
-            if track.track_type == 'Video':
-                if track.stream_size and metadata["size"]:
-                    final_size = int(track.stream_size) / 1048576  # in MiB
-                    diff = metadata["size"] - final_size
-                    size_analysis = "Final size: {:.2f} MB, saving {:.2f} MB. A size reduction of {:.2f}%".format(final_size, diff, (diff / metadata["size"]) * 100)
-                # Below not working because mediainfo lists some "fromstats" tags that are the same as the original file for some reason
-                # elif track.frame_count and total_frames and int(track.frame_count) != total_frames and not stoprequest.is_set():
-
-                # # CODE FOR automatically adding a job if the encoded frames did not match the total num of frames. Broken when changing end time
-                # if 0 < done_frames < total_frames - 300 and total_frames and not stoprequest.is_set():
-                #     gui_queue.put("Did not encode the expected amount of frames... restarting encode...\nThis feature is experimental and might mess everything up.\n")
-                #     old = [params]
-                #     while True:
-                #         try:
-                #             old.append(encode_queue.get_nowait())
-                #         except queue.Empty:
-                #             break
-                #     [encode_queue.put(i) for i in old]
+            if not encode_queue_active.wait(ASSIGN_TIMEOUT):
+                continue
+
+            # Time out now and then, so the thread of a worker that is gone stops taking from the queue
+            try:
+                job = self.encode_queue.get(timeout=ASSIGN_TIMEOUT)
+            except queue.Empty:
+                continue
+            if job is _skip and worker["alive"]:  # Every consumer gets its own _skip, see wake_encode_consumers
+                continue
+            with self.lock:
+                leaving = job is _sentinel or job is _skip or not worker["alive"] or self.stopped.is_set()
+                if not leaving:
+                    if not take_job(job):
+                        continue
+                    worker["idle"].clear()
+                    worker["job"] = job
+
+            if leaving:
+                if job is _sentinel or job is _skip:
+                    self.encode_queue.put(job)  # Leave it for the encode thread or another worker
+                elif not self.stopped.is_set():
+                    self.encode_event.put({"uuid": job["uuid"], "event": "⏱ waiting", "requeue": True})  # The GUI puts it back in its place
                 break
 
-        end_string = '** Finished encode of {}.\nDuration: {}\n{} frames **'.format(params["title"], calc_time(start_time, time.time())[0], done_frames)
+            if not send_message(worker["connection"], worker["send_lock"], {"type": "job", "job": job}):
+                break  # The job is put back when the connection is dropped
+
+    def _expire_leases(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            with self.lock:
+                expired = [worker for worker in self.workers if worker["lease"] < time.time()]
+            for worker in expired:
+                self.gui_queue.put("Lease expired for encode worker {}".format(worker["name"]))
+                close_connection(worker["connection"])  # Makes _serve drop the worker
+
+    def _drop(self, worker):
+        """Forget a worker, and put its job back in the queue"""
+        with self.lock:
+            if worker not in self.workers:
+                return
+            self.workers.remove(worker)
+            worker["alive"] = False
+            job = worker["job"]
+            worker["job"] = None
+        worker["idle"].set()  # Let the assign thread finish
+        close_connection(worker["connection"])
+
+        if job and not self.stopped.is_set():
+            with take_lock:
+                job["status"] = "⏱ waiting"
+            self.encode_event.put({"uuid": job["uuid"], "event": "⏱ waiting", "requeue": True})  # The GUI rebuilds the queue in order
+            self.gui_queue.put("Lost encode worker {}, {} was put back in the queue".format(worker["name"], job["title"]))
+        else:
+            self.gui_queue.put("Encode worker {} disconnected".format(worker["name"]))
 
-        encode_running.clear()
-        stoprequest.clear()
 
-        encode_event.put({"uuid": job_id, "event": "✓ finished"})
-        gui_queue.put(end_string + "\n{}\n".format(size_analysis))  # put a message into queue for GUI
-        status_deque.append(end_string)  # Put a message in status box
+def worker_main(address, ffmpeg_path, stop=None):
+    """Run as an encode worker for a GUI started with --listen, until the program is killed or stop is set.
+
+    Input and output paths are used as they are, so workers need to see the files on the same paths as the GUI,
+    for example through shared storage. Progress is sent back to the GUI as it would be by the local encode thread.
+
+    :param address: (str) HOST:PORT of the dispatcher
+    :param ffmpeg_path: (pathlib.Path) the filepath to the ffmpeg executable on this machine
+    :param stop: (threading.Event) makes the worker return once it is set and the connection is lost
+    """
+    import socket
+    host, port = address.rsplit(":", 1)
+    name = "{}-{}".format(platform.node(), os.getpid())
+    stop = stop or threading.Event()
+
+    while not stop.is_set():
+        try:
+            connection = socket.create_connection((host, int(port)))
+        except OSError as e:
+            print("Could not connect to {}: {}. Retrying in {}s".format(address, e, WORKER_RETRY))
+            stop.wait(WORKER_RETRY)
+            continue
+
+        send_lock = threading.Lock()
+        connected = threading.Event()
+        connected.set()
+
+        def send(message):
+            send_message(connection, send_lock, message)
+
+        def heartbeat():
+            while connected.is_set() and send_message(connection, send_lock, {"type": "heartbeat"}):
+                time.sleep(HEARTBEAT_INTERVAL)
+
+        running = {"uuid": None}  # The job being encoded, so a late cancel for a finished job is ignored
+
+        def work(job):
+            running["uuid"] = job.get("uuid")
+            try:
+                job["command"][0] = ffmpeg_path.absolute().as_posix()
+                job["input_file"] = Path(job["input_file"])
+                job["output_file"] = Path(job["output_file"])
+                done_frames, cancelled = run_encode(job, DispatcherChannel(send, "message"), DispatcherChannel(send, "status"),
+                                                    DispatcherChannel(send, "event"), DispatcherChannel(send, "log"))
+            except Exception as e:  # The dispatcher has to hear about it, or the job is stuck as started
+                encode_running.clear()
+                stoprequest.clear()
+                print("Encode failed: {}".format(e))
+                running["uuid"] = None
+                send({"type": "failed", "uuid": job.get("uuid"), "error": str(e)})
+                return
+            running["uuid"] = None
+            send({"type": "done", "uuid": job["uuid"], "done_frames": done_frames, "cancelled": cancelled})
+
+        send({"type": "register", "name": name})
+        threading.Thread(target=heartbeat, daemon=True).start()
+        print("Connected to {} as {}".format(address, name))
+
+        worker = None
+        try:
+            for line in connection.makefile("r", encoding="utf-8"):
+                message = json.loads(line)
+                if message["type"] == "job":
+                    worker = threading.Thread(target=work, args=(message["job"],), daemon=True)
+                    worker.start()
+                elif message["type"] == "cancel" and message.get("uuid") is not None and message.get("uuid") == running["uuid"]:
+                    stoprequest.set()
+        except (OSError, ValueError):
+            pass
+
+        # The dispatcher will give the job to someone else, so there is no point in finishing it
+        print("Lost connection to {}".format(address))
+        connected.clear()
+        if worker and worker.is_alive():
+            stoprequest.set()
+            worker.join()
+        stoprequest.clear()
+        close_connection(connection)
+        stop.wait(WORKER_RETRY)
 
 
 def check_paths(ffmpeg_path, gui_queue):
@@ -225,10 +1270,20 @@ def check_paths(ffmpeg_path, gui_queue):
     :param gui_queue: (Queue) a queue for handling printing
     """
     if not ffmpeg_path.exists() or not ffmpeg_path.is_file():
-        gui_queue.put("MISSING ffmpeg! Is ffmpeg at " + ffmpeg_path.absolute() + "?")
-    else:
-        gui_queue.put("Found ffmpeg")
-        print(ffmpeg_path.absolute())
+        gui_queue.put("MISSING ffmpeg! Is ffmpeg at " + str(ffmpeg_path.absolute()) + "?")
+        return
+
+    gui_queue.put("Found ffmpeg")
+    print(ffmpeg_path.absolute())
+
+    # Running ffmpeg takes a moment, which is why this function is run in the background
+    try:
+        process = subprocess.run([ffmpeg_path.absolute().as_posix(), "-hide_banner", "-encoders"], stdin=DEVNULL, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT, universal_newlines=True)
+        if "libsvt_hevc" not in process.stdout:
+            gui_queue.put("ffmpeg was found, but it is not built with SVT-HEVC (libsvt_hevc)!")
+    except OSError as e:
+        gui_queue.put("Could not run ffmpeg: " + str(e))
 
 
 def clear_queue(q):
@@ -237,37 +1292,60 @@ def clear_queue(q):
         q.queue.clear()
 
 
+@lru_cache(maxsize=None)
+def theme_preview(theme):
+    """Get the colors used to preview a theme, so we don't have to switch the whole program to each theme
+
+    :param theme: (str) the name of the theme
+    :return: a dict with the background, text and button colors of the theme
+    """
+    colors = sg.LOOK_AND_FEEL_TABLE[theme]
+    return {"background": colors["BACKGROUND"], "text": colors["TEXT"], "button": colors["BUTTON"]}
+
+
 def run_themes_window():
     """Let the user preview and pick a theme from a list of themes.
 
+    The themes are shown a page at a time, building a preview of every theme at once takes several seconds.
+
     :return: the name of the selected theme, or None if no theme selected
     """
     window_bg = 'lightblue'
 
-    def sample_layout(key):
-        return [[sg.Text('Text element', tooltip="I am a tooltip!")],
-                [sg.Button('Select', key=key, tooltip="This is a tooltip")]]
-
-    layout = [[sg.Text('Select a theme. Program must be restarted for changes to take effect', auto_size_text=True)]]
+    def sample_layout(key, colors):
+        return [[sg.Text('Text element', tooltip="I am a tooltip!", text_color=colors["text"], background_color=colors["background"])],
+                [sg.Button('Select', key=key, tooltip="This is a tooltip", button_color=colors["button"])]]
 
     names = sg.list_of_look_and_feel_values()
     names.sort()
-    row = []
-    for count, theme in enumerate(names):
-        sg.change_look_and_feel(theme)
-        if not count % 9:
+    pages = [names[i:i + THEMES_PER_PAGE] for i in range(0, len(names), THEMES_PER_PAGE)]
+    page = 0
+
+    while True:
+        layout = [[sg.Text('Select a theme. Program must be restarted for changes to take effect', auto_size_text=True)]]
+        row = []
+        for count, theme in enumerate(pages[page]):
+            if count and not count % THEMES_PER_ROW:
+                layout += [row]
+                row = []
+            colors = theme_preview(theme)
+            row += [sg.Frame(theme, sample_layout(theme, colors), background_color=colors["background"], title_color=colors["text"])]
+        if row:
             layout += [row]
-            row = []
-        row += [sg.Frame(theme, sample_layout(key=theme))]
-    if row:
-        layout += [row]
+        layout += [[sg.Button("< Previous", disabled=page == 0), sg.Text("Page {} of {}".format(page + 1, len(pages))), sg.Button("Next >", disabled=page == len(pages) - 1)]]
+
+        theme_window = sg.Window('All themes', layout, background_color=window_bg)
+        event, vals = theme_window.read()
 
-    theme_window = sg.Window('All themes', layout, background_color=window_bg)
-    event, vals = theme_window.read()
+        theme_window.close()
+        del theme_window
 
-    theme_window.close()
-    del theme_window
-    return event
+        if event == "< Previous":
+            page -= 1
+        elif event == "Next >":
+            page += 1
+        else:
+            return event
 
 
 def write_settings(settings_path, settings):
@@ -275,14 +1353,31 @@ def write_settings(settings_path, settings):
         json.dump(settings, file)
 
 
-def the_gui():
-    """Starts and executes the GUI
+def the_gui(listen_port=None, exit_after_start=False):
+    """Starts and executes the GUI, with everything that is printed going to the log
 
     Returns when the user exits / closes the window
+
+    :param listen_port: (int) if set, encode workers can connect on this port and take jobs from the queue
+    :param exit_after_start: (bool) start with a hidden window and exit right after the first read, for measuring startup
+    """
+    log = LogStore(Path("svt_gui.log"))
+    stdout = sys.stdout
+    sys.stdout = log
+    try:
+        run_gui(log, listen_port, exit_after_start)
+    finally:
+        sys.stdout = stdout
+
+
+def run_gui(log, listen_port=None, exit_after_start=False):
+    """The GUI itself, see the_gui
+
+    :param log: (LogStore) the log that stdout has been redirected to
     """
     ffmpeg_path = Path('ffmpeg_hevc.exe')
     settings_path = Path("settings.json")
-    presets = {0: "placebo", 1: "placebo", 2: "placebo", 3: "placebo", 4: "veryslow", 5: "slower", 6: "slow", 7: "medium", 8: "fast", 9: "faster", 10: "veryfast", 11: "superfast", 12: "ultrafast"}
+    profile_path = Path("calibration_{}.json".format(platform.node()))
 
     # queue used to communicate between the gui and the threads
     gui_queue = queue.Queue()
@@ -292,12 +1387,16 @@ def the_gui():
 
     encode_event = queue.Queue()  # queue for handling when encodes finish and start
 
+    analysis_queue = queue.Queue()  # queue for handing finished encodes over to the analysis pool
+
     # Define default settings to make it possible to generate settings.json
     settings = {"settings": {"theme": "Default1"}}
 
     status_deque = deque(maxlen=1)  # deque for handling the status bar element
 
-    check_paths(ffmpeg_path, gui_queue)
+    log_view = {"version": 0, "back": 0, "scrolled": False, "slider": (0, 0)}  # What the log view currently shows
+
+    threading.Thread(target=check_paths, args=(ffmpeg_path, gui_queue), daemon=True).start()
 
     # Load settings from json if it exist
     if settings_path.exists():
@@ -324,6 +1423,8 @@ def the_gui():
         "pause_queue": "Once the queue is paused the current job will finish, but the next job will not be started.",
         "start_encode": "Add job to queue, start it if no encode is currently running.",
         # MISC
+        "quality_metrics": "Measure SSIM and PSNR against the source on a few segments once the encode is finished. \nRuns in the background, but uses some cpu while the next encode is running",
+        "deadline": "How long the encode may take, as HH:MM:SS. \nAdvise preset recommends the preset giving the smallest file that still finishes in time. \nRequires calibrating presets from the settings menu first",
         "test_encode": "Only encode part of the video. Lets you compare quality of encode to source, and estimate filesize. \nSpecify how many frames, usually 1000 is enough"
     }
 
@@ -345,6 +1446,7 @@ def the_gui():
         "n_frames": "1000",
         "start_time": "00:00:00.000",
         "end_time": "",
+        "quality_metrics": False,
     }
 
     old_params = params.copy()
@@ -359,7 +1461,7 @@ def the_gui():
         "height": None,
     }
 
-    menu_def = [['&Settings', ['&Themes', '!&Preferences', '---', 'E&xit']], ['&Presets', ['!&Save preset', '---', '!Preset1']]]
+    menu_def = [['&Settings', ['&Themes', 'Calibrate presets', '!&Preferences', '---', 'E&xit']], ['&Presets', ['!&Save preset', '---', '!Preset1']]]
 
     drc_col = [
         [
@@ -419,24 +1521,37 @@ def the_gui():
         [sg.Frame("Encode options", encoding_col)],
         [sg.Frame("Audio options", audio_col), sg.Frame("Filters", filter_col)],
         [sg.Frame("Video", video_col)],
-        [sg.Frame("Misc", [[sg.Checkbox("Test encode (n frames)", size=(16, 1), key="-TEST_ENCODE-", enable_events=True, tooltip=tooltips["test_encode"]), sg.Input(default_text=params["n_frames"], size=(5, 1), enable_events=True, key="-TEST_FRAMES-", disabled=True, tooltip=tooltips["test_encode"])], [sg.T("Start time", size=(7, 1)), sg.Input(default_text=params["start_time"], enable_events=True, key="-START_TIME-", size=(9, 1), tooltip="Start timestamp"), sg.T("End time", size=(6, 1)), sg.Input(default_text="00:00:00.000", enable_events=True, key="-END_TIME-", size=(9, 1), tooltip="End timestamp")]])],
+        [sg.Frame("Misc", [[sg.Checkbox("Test encode (n frames)", size=(16, 1), key="-TEST_ENCODE-", enable_events=True, tooltip=tooltips["test_encode"]), sg.Input(default_text=params["n_frames"], size=(5, 1), enable_events=True, key="-TEST_FRAMES-", disabled=True, tooltip=tooltips["test_encode"])], [sg.T("Start time", size=(7, 1)), sg.Input(default_text=params["start_time"], enable_events=True, key="-START_TIME-", size=(9, 1), tooltip="Start timestamp"), sg.T("End time", size=(6, 1)), sg.Input(default_text="00:00:00.000", enable_events=True, key="-END_TIME-", size=(9, 1), tooltip="End timestamp")], [sg.Checkbox("Quality metrics (SSIM/PSNR)", key="-METRICS-", enable_events=True, tooltip=tooltips["quality_metrics"])], [sg.T("Deadline", size=(6, 1), tooltip=tooltips["deadline"]), sg.Input(default_text="01:00:00", key="-DEADLINE-", size=(9, 1), tooltip=tooltips["deadline"]), sg.Button("Advise preset", tooltip=tooltips["deadline"])]])],
         # [sg.Frame("Command", [[sg.Column([[sg.Multiline(key="-COMMAND-", size=(60, 3))]])]])],
-        [sg.Frame("Queue", [[sg.Column([[sg.Listbox(values=[], key="-QUEUE_DISPLAY-")], [sg.Button("Remove task", size=(15, 1)), sg.Button("UP", size=(7, 1)), sg.Button("DOWN", size=(7, 1))]])]])],
+        [sg.Frame("Queue", [[sg.Column([[sg.Listbox(values=[], key="-QUEUE_DISPLAY-")], [sg.Button("Remove task", size=(15, 1)), sg.Button("UP", size=(7, 1)), sg.Button("DOWN", size=(7, 1)), sg.Button("Show log", size=(10, 1))]])]])],
         [sg.Button("Start encode / add to queue", key="Start encode", size=(20, 1), tooltip=tooltips["start_encode"]), sg.Button("Stop encode", size=(20, 1)), sg.Button("Pause queue", key="Pause queue", size=(20, 1), tooltip=tooltips["pause_queue"])],
         [sg.T("", key="-STATUS_BOX-")],
-        [sg.Output()],  # Disable this line to get output to the console
+        [sg.Multiline(size=(80, LOG_VIEW_ROWS), key="-LOG-", disabled=True), sg.Slider(range=(0, 0), default_value=0, orientation="vertical", key="-LOG_SCROLL-", enable_events=True, tooltip="Scroll back in the log")],
         # [sg.ProgressBar(100, key="-PROGRESSBAR-")],
         [sg.Button('Exit')],
     ]
 
-    window = sg.Window('SVT_GUI', layout)
+    window = sg.Window('SVT_GUI', layout, alpha_channel=0 if exit_after_start else 1)  # Hidden when only measuring startup
 
-    encoder = threading.Thread(target=encode_thread, args=(encode_queue, gui_queue, status_deque, encode_event), daemon=True)
+    encoder = threading.Thread(target=encode_thread, args=(encode_queue, gui_queue, status_deque, encode_event, analysis_queue, log), daemon=True)
     try:
         encoder.start()
     except Exception as e:
         print('Error starting work thread. Bad input?\n ' + str(e))
 
+    analyzers = [threading.Thread(target=analysis_thread, args=(analysis_queue, gui_queue, encode_event, ffmpeg_path), daemon=True) for _ in range(ANALYSIS_WORKERS)]
+    for analyzer in analyzers:
+        analyzer.start()
+
+    dispatcher = None
+    if listen_port:
+        dispatcher = Dispatcher(listen_port, encode_queue, gui_queue, status_deque, encode_event, analysis_queue, log)
+        try:
+            dispatcher.start()
+        except OSError as e:
+            print("Could not listen for encode workers on port {}: {}".format(listen_port, e))
+            dispatcher = None
+
     encode_queue_active.set()  # Start active
 
     # progressbar = window["-PROGRESSBAR-"]
@@ -463,8 +1578,26 @@ def the_gui():
 
         n_frames = params["n_frames"] if params["test_encode"] != "" else ""  # Disable vframes number if we dont want to do test encode
 
+        # If the input is indexed we can seek straight to the keyframe before the start time, and only decode from there.
+        # Timestamps then start at the keyframe, so the output seek and end time are made relative to it
+        input_seek = ""
+        start_time = params["start_time"]
+        end_time = params["end_time"]
+        try:
+            index = load_keyframe_index(Path(params["input"])) if input_text else None
+        except OSError:  # The input was moved or deleted since it was selected
+            index = None
+        start = parse_timestamp(params["start_time"])
+        if index and start:
+            keyframe = index.keyframe_before(start)
+            if keyframe:
+                input_seek = "{:.3f}".format(keyframe)
+                start_time = "{:.3f}".format(start - keyframe)
+                if parse_timestamp(end_time):
+                    end_time = "{:.3f}".format(parse_timestamp(end_time) - keyframe)
+
         # Filter list before return to remove empty strings
-        return list(filter(None, ["-i", input_text, "-y", "-ss", params["start_time"], ("-to" if params["end_time"] else ""), params["end_time"], "-sn", params["skip_audio"], "-map", "0", enable_filters, filters, "-c:v", "libsvt_hevc", params["test_encode"], n_frames, "-rc", str(params["drc"]), "-qmin", str(params["qmin"]), "-qmax", str(params["qmax"]), "-qp", str(params["qp"]), "-preset", str(params["preset"]), output_text]))
+        return list(filter(None, [("-ss" if input_seek else ""), input_seek, "-i", input_text, "-y", "-ss", start_time, ("-to" if end_time else ""), end_time, "-sn", params["skip_audio"], "-map", "0", enable_filters, filters, "-c:v", "libsvt_hevc", params["test_encode"], n_frames, "-rc", str(params["drc"]), "-qmin", str(params["qmin"]), "-qmax", str(params["qmax"]), "-qp", str(params["qp"]), "-preset", str(params["preset"]), output_text]))
 
     def toggle_queue():
         if encode_queue_active.is_set():
@@ -481,18 +1614,27 @@ def the_gui():
 
     def autocrop():
         try:
-            # TODO: If the video is shorter than around 16 seconds we might not get any crop values because of the low framerate and start time
-            start_time = int((video_metadata["duration"] / 4) / 1000)  # Start detecting crop at 1/4 of the video duration
-            command = [ffmpeg_path.absolute().as_posix(), "-ss", str(start_time), "-i", str(Path(params["input"])), "-t", "01:20", "-vsync",
-                       "vfr", "-vf", "fps=0.2,cropdetect", "-f", "null", "-"]
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                       universal_newlines=True, close_fds=True)
-            # out, err = process.communicate()
+            input_path = Path(params["input"])
+            index = load_keyframe_index(input_path)
+            if index and len(index.keyframes):
+                # Sample short stretches spread over the whole video, starting on keyframes so seeking is cheap
+                samples = [(point, AUTOCROP_SAMPLE, "fps=0.5,cropdetect") for point in index.scene_safe_points(AUTOCROP_POINTS)]
+            else:
+                # TODO: If the video is shorter than around 16 seconds we might not get any crop values because of the low framerate and start time
+                start_time = int((video_metadata["duration"] / 4) / 1000)  # Start detecting crop at 1/4 of the video duration
+                samples = [(start_time, 80, "fps=0.2,cropdetect")]
+
             crop_values = []
-            for line in process.stdout:
-                # print(line)
-                if "crop=" in line:
-                    crop_values.append(line.split("crop=")[1])
+            for start_time, length, filters in samples:
+                command = [ffmpeg_path.absolute().as_posix(), "-ss", str(start_time), "-i", str(input_path), "-t", str(length), "-vsync",
+                           "vfr", "-vf", filters, "-f", "null", "-"]
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                           universal_newlines=True, close_fds=True)
+                # out, err = process.communicate()
+                for line in process.stdout:
+                    # print(line)
+                    if "crop=" in line:
+                        crop_values.append(line.split("crop=")[1])
 
             if len(crop_values) > 0:
                 most_common = max(set(crop_values), key=crop_values.count)
@@ -511,16 +1653,43 @@ def the_gui():
     def update_queue_display():
         window.Element("-QUEUE_DISPLAY-").update(values=[i["status"] + " | " + i["title"] + " - " + i["uuid"] for i in encode_list])
 
+    def update_log_view():
+        """Redraw the log view, but only when there is something new to show"""
+        added = log.version - log_view["version"]
+        if not added and not log_view["scrolled"]:
+            return
+        if added and log_view["back"]:
+            log_view["back"] += added  # Keep showing the same lines while the user is scrolled back
+        max_back = max(0, len(log) - LOG_VIEW_ROWS)
+        log_view["back"] = min(log_view["back"], max_back)
+        log_view["version"] = log.version
+        log_view["scrolled"] = False
+
+        # Updating the slider fires a new scroll event, so only do it when something changed
+        if (log_view["back"], max_back) != log_view["slider"]:
+            log_view["slider"] = (log_view["back"], max_back)
+            window.Element("-LOG_SCROLL-").update(value=log_view["back"], range=(0, max_back))
+        window.Element("-LOG-").update(log.view(LOG_VIEW_ROWS, log_view["back"]))
+
     def build_encode_queue():
         clear_queue(encode_queue)
         for i in encode_list:
             if i["status"] == "⏱ waiting":
                 encode_queue.put(i)
 
+    first_read = True
+
     #                                                        #
     # --------------------- EVENT LOOP --------------------- #
     while True:
         event, values = window.read(timeout=100)
+
+        if first_read:
+            print("Started in {:.2f}s".format(time.perf_counter() - STARTUP_TIME))
+            first_read = False
+            if exit_after_start:
+                break
+
         if event in (None, 'Exit'):
             break
 
@@ -539,7 +1708,7 @@ def the_gui():
                 window.Element("-OUTPUT-").update(str(new_file.absolute()))
 
                 print("** Analyzing input using mediainfo... **")
-                media_info = MediaInfo.parse(str(input_file.absolute()))
+                media_info = pymediainfo.MediaInfo.parse(str(input_file.absolute()))
 
                 for track in media_info.tracks:
                     if track:
@@ -584,6 +1753,9 @@ def the_gui():
 
                 print('** Analyze done **')
 
+                if video_metadata["contains_video"]:
+                    threading.Thread(target=index_thread, args=(ffmpeg_path, input_file.absolute(), settings["settings"].get("index_scenes", False), gui_queue), daemon=True).start()
+
             else:
                 print("Can't find file: " + str(input_file.absolute()))
 
@@ -612,9 +1784,13 @@ def the_gui():
                 window.Element("-QMAX-").update(disabled=True)
                 window.Element("-QP-").update(disabled=False)
 
-        elif event == "-PRESET-":  # TODO: handle limiting preset by resolution as per https://github.com/OpenVisualCloud/SVT-HEVC/blob/master/Docs/svt-hevc_encoder_user_guide.md#encoding-presets-table
-            window.Element("-PRESET_TEXT-").update("Preset ({})".format(presets[values["-PRESET-"]]))
+        elif event == "-PRESET-":  # Limits as per https://github.com/OpenVisualCloud/SVT-HEVC/blob/master/Docs/svt-hevc_encoder_user_guide.md#encoding-presets-table
+            window.Element("-PRESET_TEXT-").update("Preset ({})".format(PRESETS[values["-PRESET-"]]))
             params["preset"] = values["-PRESET-"]
+            if video_metadata["width"] and video_metadata["height"]:
+                width, height = output_resolution(video_metadata["width"], video_metadata["height"], params["crop"])
+                if params["preset"] > max_preset(width, height):
+                    print("Preset {} is not supported at {}x{}, the fastest allowed is {} ({})".format(PRESETS[params["preset"]], width, height, max_preset(width, height), PRESETS[max_preset(width, height)]))
 
         elif event == "-TEST_ENCODE-":
             val = values["-TEST_ENCODE-"]
@@ -630,6 +1806,9 @@ def the_gui():
             window.Element("-TEST_FRAMES-").update(val)
             params["n_frames"] = val
 
+        elif event == "-METRICS-":
+            params["quality_metrics"] = values["-METRICS-"]
+
         elif event == "-START_TIME-":
             params["start_time"] = values["-START_TIME-"]
 
@@ -672,6 +1851,7 @@ def the_gui():
                     for i, job in enumerate(encode_list):
                         if job["uuid"] == job_id and job["status"] != "▶ started":
                             encode_list.pop(i)
+                            log.forget(job_id)
 
             build_encode_queue()
             update_queue_display()
@@ -696,6 +1876,20 @@ def the_gui():
                 build_encode_queue()
                 update_queue_display()
 
+        elif event == "-LOG_SCROLL-":
+            log_view["back"] = int(values["-LOG_SCROLL-"])
+            log_view["scrolled"] = True
+
+        elif event == "Show log":
+            if values["-QUEUE_DISPLAY-"] and len(values["-QUEUE_DISPLAY-"]) == 1:
+                job_id = values["-QUEUE_DISPLAY-"][0].split()[-1]
+                for job in encode_list:
+                    if job["uuid"] == job_id:
+                        job_text = "\n".join(log.job_log(job_id)) or "Nothing logged yet"
+                        if "analysis" in job:
+                            job_text += "\n\n" + format_analysis(job, job["analysis"])
+                        sg.popup_scrolled(job_text, title=job["title"])
+
         ##################
         # OTHER INTERACTS
         elif event == "Start encode":
@@ -710,7 +1904,8 @@ def the_gui():
 
                 try:
                     job_id = uuid.uuid4().hex
-                    encode_list.append({"title": video_metadata["name"], "uuid": job_id, "status": "⏱ waiting", "output_file": Path(params["output"]), "command": finished_command, "metadata": video_metadata, "test_encode": int(params["n_frames"]) if params["test_encode"] != "" else False})
+                    encode_list.append({"title": video_metadata["name"], "uuid": job_id, "status": "⏱ waiting", "input_file": Path(params["input"]), "output_file": Path(params["output"]), "command": finished_command, "metadata": video_metadata.copy(), "test_encode": int(params["n_frames"]) if params["test_encode"] != "" else False,
+                                        "start_time": params["start_time"], "end_time": params["end_time"], "crop": params["crop"], "quality_metrics": params["quality_metrics"]})
                     build_encode_queue()
                     update_queue_display()
                 except Exception as e:  # TODO: make this better. Is it even needed?
@@ -718,18 +1913,58 @@ def the_gui():
 
         elif event == "Stop encode":
             if encoder is not None:
-                stoprequest.set()
+                if encode_running.is_set() or calibration_running.is_set():  # Only run_encode and calibration clear it again
+                    stoprequest.set()
                 pause_queue()
+            if dispatcher is not None:
+                dispatcher.cancel_all()
 
         elif event == "Pause queue":
             toggle_queue()
-            encode_queue.put(_skip)
+            wake_encode_consumers(encode_queue, dispatcher)
 
         elif event == "Autocrop":
             crop = autocrop()
             params["crop"] = "crop=" + crop
             window.Element("-CROP-").update(crop)
 
+        elif event == "Calibrate presets":
+            if not video_metadata["contains_video"] or not video_metadata["fps"]:
+                print("Select an input file to calibrate with first")
+            elif encode_running.is_set() or calibration_running.is_set():
+                print("Wait for the running encode or calibration to finish before calibrating")
+            else:
+                pause_queue()  # Encodes running at the same time would ruin the measurements
+                wake_encode_consumers(encode_queue, dispatcher)  # Wake the encode thread and workers so they see the pause
+                threading.Thread(target=calibration_thread, args=(ffmpeg_path, Path(params["input"]), video_metadata.copy(), gui_queue, profile_path, analysis_queue), daemon=True).start()
+
+        elif event == "Advise preset":
+            deadline = parse_timestamp(values["-DEADLINE-"])
+            frames = expected_frames({"metadata": video_metadata, "start_time": params["start_time"], "end_time": params["end_time"], "test_encode": False})
+            if not profile_path.exists():
+                print("No calibration found for this machine. Run Settings > Calibrate presets first")
+            elif not video_metadata["width"] or not video_metadata["height"]:
+                print("Select an input file first")
+            elif not frames:
+                print("Can not tell how many frames will be encoded, check the start and end time")
+            elif not deadline:
+                print("Invalid deadline, use HH:MM:SS")
+            else:
+                width, height = output_resolution(video_metadata["width"], video_metadata["height"], params["crop"])
+                try:
+                    with profile_path.open() as file:
+                        profile = json.load(file)
+                    preset, advice = advise_preset(profile, width, height, frames, deadline, int(params["qp"]))
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    print("Could not read the calibration in {} ({}). Run Settings > Calibrate presets again".format(profile_path, e))
+                    preset, advice = None, None
+                if advice:
+                    print(advice)
+                if preset is not None:
+                    params["preset"] = preset
+                    window.Element("-PRESET-").update(preset)
+                    window.Element("-PRESET_TEXT-").update("Preset ({})".format(PRESETS[preset]))
+
         elif event == "Themes":
             theme = run_themes_window()
             # Save theme
@@ -756,8 +1991,13 @@ def the_gui():
             for i, job in enumerate(encode_list):
                 if job["uuid"] == event["uuid"]:
                     item = encode_list[i]
-                    item["status"] = event["event"]
+                    if "event" in event:
+                        item["status"] = event["event"]
+                    if "analysis" in event:
+                        item["analysis"] = event["analysis"]
                     encode_list[i] = item
+                    if event.get("requeue"):  # A job lost by an encode worker goes back in its place in the queue
+                        build_encode_queue()
                     update_queue_display()
         except queue.Empty:
             pass
@@ -766,6 +2006,8 @@ def the_gui():
         if message:
             print("#> " + message)
 
+        update_log_view()
+
         # Update display of the encode command
         # if params.items() != old_params.items():
         #     update_command()
@@ -774,6 +2016,8 @@ def the_gui():
     # We have reached the end of the program, so lets clean up.
     window.disable()
     window.refresh()  # have to refresh window manually outside of event loop
+    if dispatcher is not None:
+        dispatcher.stop()
     if encoder is not None:
         stoprequest.set()
         # Clear queue then add sentinel to make thread stop waiting
@@ -781,6 +2025,10 @@ def the_gui():
         encode_queue.put(_sentinel)
         encode_queue_active.set()  # We have to make sure the encode queue is active for it to finish, if not it will keep waiting
 
+        # The analyzers are daemons, so we don't wait for analyses that are still running
+        for _ in analyzers:
+            analysis_queue.put(_sentinel)
+
         print("\n** Taking a sec to shut everything down... **\n")
         window.refresh()
 
@@ -792,5 +2040,71 @@ def the_gui():
     window.close()
 
 
+def measure_module_load(runs=3):
+    """Measure loading this module in fresh interpreters, and find the modules in DEFERRED_MODULES it imported
+
+    :param runs: (int) how many times to measure
+    :return: a tuple of (fastest load time in seconds, list of deferred modules that were imported anyway)
+    """
+    script = ("import importlib.util, sys, time\n"
+              "start = time.perf_counter()\n"
+              "spec = importlib.util.spec_from_file_location('simple_gui', sys.argv[1])\n"
+              "spec.loader.exec_module(importlib.util.module_from_spec(spec))\n"
+              "print(time.perf_counter() - start)\n"
+              "print(','.join(name for name in sys.argv[2:] if name in sys.modules))\n")
+    this_file = str(Path(__file__).absolute())
+
+    load_timings = []
+    eager_imports = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", script, this_file] + DEFERRED_MODULES, stdout=subprocess.PIPE,
+                                universal_newlines=True, check=True).stdout.splitlines()
+        load_timings.append(float(output[0]))
+        eager_imports = output[1].split(",") if len(output) > 1 and output[1] else []
+    return min(load_timings), eager_imports
+
+
+def benchmark_startup(runs=3):
+    """Measure startup in fresh interpreters, to catch startup regressions.
+
+    Two things are measured: loading this module, which must not import the GUI toolkit, pymediainfo or the modules
+    only used by some features, and a cold start of the GUI with a hidden window, until the first window read.
+    The first part is also checked by the tests.
+
+    :param runs: (int) how many times to measure. The fastest runs are compared to the budgets
+    :return: True if startup is within budget
+    """
+    load_time, eager_imports = measure_module_load(runs)
+    print("Loaded module in {:.3f}s (best of {}), budget is {:.3f}s".format(load_time, runs, STARTUP_BUDGET))
+    if eager_imports:
+        print("Imported during startup, should be deferred: " + ", ".join(eager_imports))
+
+    start_timings = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        process = subprocess.run([sys.executable, str(Path(__file__).absolute()), "--exit-after-start"], stdout=DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        if process.returncode != 0:
+            print("Could not start the GUI:\n" + process.stderr)
+            return False
+        start_timings.append(time.perf_counter() - start_time)
+
+    print("Started GUI in {:.3f}s (best of {}), budget is {:.3f}s".format(min(start_timings), runs, GUI_STARTUP_BUDGET))
+    return load_time <= STARTUP_BUDGET and min(start_timings) <= GUI_STARTUP_BUDGET and not eager_imports
+
+
 if __name__ == '__main__':
-    the_gui()
+    import argparse
+    parser = argparse.ArgumentParser(description="A GUI for creating and running video encodes with ffmpeg and the SVT-HEVC encoder")
+    parser.add_argument("--benchmark-startup", action="store_true", help="measure startup time and exit with an error if it is over budget")
+    parser.add_argument("--exit-after-start", action="store_true", help="start the GUI hidden and exit once it is up, used by --benchmark-startup")
+    parser.add_argument("--listen", type=int, metavar="PORT", help="let encode workers connect on this port and take jobs from the queue")
+    parser.add_argument("--worker", metavar="HOST:PORT", help="run without a GUI as an encode worker for the GUI listening at HOST:PORT")
+    parser.add_argument("--ffmpeg", default="ffmpeg_hevc.exe", help="the ffmpeg executable used by --worker (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.benchmark_startup:
+        sys.exit(0 if benchmark_startup() else 1)
+    if args.worker:
+        worker_main(args.worker, Path(args.ffmpeg))
+    else:
+        the_gui(args.listen, args.exit_after_start)
@@ -0,0 +1,9 @@
+"""Simple-GUI.py is not an importable name, so it is loaded here once and registered as simple_gui for the tests"""
+import importlib.util
+import sys
+from pathlib import Path
+
+spec = importlib.util.spec_from_file_location("simple_gui", str(Path(__file__).resolve().parent.parent / "Simple-GUI.py"))
+simple_gui = importlib.util.module_from_spec(spec)
+sys.modules["simple_gui"] = simple_gui
+spec.loader.exec_module(simple_gui)
@@ -0,0 +1,68 @@
+"""Checks of what a finished encode is expected to contain, and how the analysis is reported"""
+import simple_gui as gui
+
+
+def make_job(**job):
+    metadata = {"fps": "25", "frame_count": "1000", "size": 100}
+    return dict({"title": "job", "metadata": metadata, "start_time": None, "end_time": None, "test_encode": False}, **job)
+
+
+def make_analysis(**analysis):
+    return dict({"frames": 1000, "expected_frames": 1000, "frames_match": True, "cancelled": False, "size": 40.0,
+                 "source_size": 100.0, "ssim": None, "psnr": None}, **analysis)
+
+
+def test_parse_timestamp():
+    assert gui.parse_timestamp("01:02:03.5") == 3723.5
+    assert gui.parse_timestamp("02:03") == 123
+    assert gui.parse_timestamp("7") == 7
+    assert gui.parse_timestamp("") is None
+    assert gui.parse_timestamp("1:x") is None
+
+
+def test_expected_frames_of_whole_file():
+    assert gui.expected_frames(make_job()) == 1000
+
+
+def test_expected_frames_between_start_and_end():
+    assert gui.expected_frames(make_job(start_time="00:00:10", end_time="00:00:20")) == 250
+    assert gui.expected_frames(make_job(start_time="00:00:10")) == 750
+
+
+def test_expected_frames_of_test_encode():
+    assert gui.expected_frames(make_job(test_encode=100)) == 100
+    assert gui.expected_frames(make_job(test_encode=5000)) == 1000
+    assert gui.expected_frames(make_job(test_encode=100, metadata={"fps": None, "frame_count": None})) == 100
+
+
+def test_expected_frames_is_none_when_end_is_not_after_start():
+    assert gui.expected_frames(make_job(start_time="00:00:10", end_time="00:00:05")) is None
+    assert gui.expected_frames(make_job(start_time="00:00:10", end_time="00:00:10")) is None
+    assert gui.expected_frames(make_job(start_time="00:01:00")) is None  # Starts after the last frame
+
+
+def test_expected_frames_without_metadata():
+    assert gui.expected_frames(make_job(metadata={"fps": None, "frame_count": None})) is None
+
+
+def test_format_analysis_reports_size_and_frames():
+    text = gui.format_analysis(make_job(), make_analysis())
+    assert "Final size: 40.00 MB, saving 60.00 MB. A size reduction of 60.00%" in text
+    assert "Frame count OK (1000 frames)" in text
+
+
+def test_format_analysis_reports_mismatch():
+    text = gui.format_analysis(make_job(), make_analysis(frames=900, frames_match=False))
+    assert "Frame count mismatch! Encoded 900 frames, expected 1000" in text
+
+
+def test_format_analysis_of_stopped_encode():
+    text = gui.format_analysis(make_job(), make_analysis(frames=300, frames_match=None, cancelled=True))
+    assert "Encode was stopped after 300 frames" in text
+    assert "mismatch" not in text
+
+
+def test_format_analysis_with_quality_metrics():
+    text = gui.format_analysis(make_job(), make_analysis(ssim=0.98765, psnr=41.234, source_size=None))
+    assert "Final size: 40.00 MB\n" in text
+    assert "SSIM: 0.9877" in text and "PSNR: 41.23 dB" in text
@@ -0,0 +1,71 @@
+"""Checks of the preset advice given from a calibration profile"""
+import pytest
+
+import simple_gui as gui
+
+
+def result(preset, fps, bitrate, qp=26, ssim=0.98):
+    return {"preset": preset, "qp": qp, "fps": fps, "bitrate": bitrate, "ssim": ssim}
+
+
+def make_profile(*results):
+    return {"width": 1920, "height": 1080, "results": list(results)}
+
+
+def test_max_preset_depends_on_resolution():
+    assert gui.max_preset(1280, 720) == 9
+    assert gui.max_preset(1920, 1080) == 10
+    assert gui.max_preset(3840, 2160) == 12
+
+
+def test_output_resolution_uses_crop():
+    assert gui.output_resolution(1920, 1080, "crop=1920:800:0:140") == (1920, 800)
+    assert gui.output_resolution("1920", "1080", "") == (1920, 1080)
+    assert gui.output_resolution(1920, 1080, None) == (1920, 1080)
+
+
+def test_pareto_frontier_drops_dominated_results():
+    fast = result(9, fps=100, bitrate=3000)
+    small = result(5, fps=10, bitrate=1000)
+    dominated = result(7, fps=50, bitrate=3500)  # Slower and bigger than fast
+    equal = result(8, fps=100, bitrate=3000)  # Ties do not dominate each other
+    assert gui.pareto_frontier([fast, small, dominated, equal]) == [fast, small, equal]
+    assert gui.pareto_frontier([]) == []
+
+
+def test_advise_preset_picks_smallest_fast_enough():
+    profile = make_profile(result(5, fps=10, bitrate=1000), result(7, fps=40, bitrate=2000), result(9, fps=100, bitrate=3000))
+    preset, advice = gui.advise_preset(profile, 1920, 1080, frames=3000, deadline=100, qp=26)  # Needs 30 fps
+    assert preset == 7
+    assert "30.0 fps needed" in advice
+
+
+def test_advise_preset_scales_speed_by_resolution():
+    profile = make_profile(result(5, fps=10, bitrate=1000), result(7, fps=40, bitrate=2000), result(9, fps=100, bitrate=3000))
+    # Half the pixels of the calibration, so everything is twice as fast and 20 fps is enough
+    preset, _ = gui.advise_preset(profile, 1920, 540, frames=2000, deadline=100, qp=26)
+    assert preset == 5
+
+
+def test_advise_preset_when_nothing_is_fast_enough():
+    profile = make_profile(result(5, fps=10, bitrate=1000), result(9, fps=100, bitrate=3000))
+    preset, advice = gui.advise_preset(profile, 1920, 1080, frames=100000, deadline=100, qp=26)
+    assert preset == 9
+    assert advice.startswith("No preset is fast enough")
+
+
+def test_advise_preset_uses_nearest_qp_and_allowed_presets():
+    profile = make_profile(result(5, fps=10, bitrate=1000, qp=20), result(6, fps=10, bitrate=500, qp=26),
+                           result(10, fps=500, bitrate=100, qp=26))
+    preset, _ = gui.advise_preset(profile, 1280, 720, frames=100, deadline=100, qp=30)  # Preset 10 needs 1080p
+    assert preset == 6
+
+    preset, advice = gui.advise_preset(make_profile(result(10, fps=500, bitrate=100)), 1280, 720, frames=100, deadline=100, qp=26)
+    assert preset is None
+    assert "None of the calibrated presets" in advice
+
+
+def test_advise_preset_with_empty_profile_raises_value_error():
+    # The GUI catches this and asks for a new calibration
+    with pytest.raises(ValueError):
+        gui.advise_preset(make_profile(), 1920, 1080, frames=100, deadline=100, qp=26)
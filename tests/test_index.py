@@ -0,0 +1,153 @@
+"""Checks of the keyframe index: the cache file format, and finding keyframes and split points in it"""
+import os
+import stat
+import struct
+import sys
+from array import array
+
+import pytest
+
+import simple_gui as gui
+
+# Prints what ffmpeg prints for a stream copy to framecrc, and for metadata=print when scenes are detected
+FAKE_FFMPEG = """import sys
+print("#tb 0: 1/1000")
+for i in range(10):
+    flags = "" if i % 3 == 0 else ", F=0x0"
+    pts = i * 500 if i != 6 else -0x8000000000000000
+    print("0, {:8d}, {:8d}, 500, 1000, 0x12345678{}".format(i * 500, pts, flags))
+if "-vf" in sys.argv:
+    for time, score in ((1.2, 0.5), (3.9, 0.8)):
+        sys.stderr.write("[Parsed_metadata_2 @ 0x1] frame:1 pts:1 pts_time:{}\\n".format(time))
+        sys.stderr.write("[Parsed_metadata_2 @ 0x1] lavfi.scene_score={}\\n".format(score))
+"""
+
+
+def write_index(path, keyframes, scene_times=(), scene_scores=()):
+    with path.open("wb") as file:
+        file.write(struct.pack(gui.INDEX_HEADER, len(keyframes), len(scene_times), len(scene_scores)))
+        for values in (keyframes, scene_times, scene_scores):
+            array("d", values).tofile(file)
+    return gui.KeyframeIndex(path)
+
+
+@pytest.fixture
+def make_index(tmp_path):
+    def make(keyframes, scene_times=(), scene_scores=None):
+        return write_index(tmp_path / "test.idx", keyframes, scene_times, [0.5] * len(scene_times) if scene_scores is None else scene_scores)
+    return make
+
+
+@pytest.fixture
+def ffmpeg(tmp_path):
+    script = tmp_path / "ffmpeg.py"
+    script.write_text(FAKE_FFMPEG)
+    if os.name == "nt":
+        path = tmp_path / "ffmpeg.bat"
+        path.write_text('@"{}" "{}" %*\n'.format(sys.executable, script))
+    else:
+        path = tmp_path / "ffmpeg"
+        path.write_text("#!{}\n".format(sys.executable) + FAKE_FFMPEG)
+        path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return path
+
+
+def test_index_file_round_trip(make_index):
+    index = make_index([0.0, 2.0, 4.0], [1.5], [0.7])
+    assert list(index.keyframes) == [0.0, 2.0, 4.0]
+    assert list(index.scene_times) == [1.5]
+    assert list(index.scene_scores) == [0.7]
+
+
+def test_empty_index(make_index):
+    index = make_index([])
+    assert len(index.keyframes) == 0
+    assert index.keyframe_before(1) is None
+    assert index.keyframe_after(1) is None
+    assert index.nearest_keyframe(1) is None
+    assert index.scene_cut_near(1) is None
+    assert index.scene_safe_points(3) == []
+
+
+def test_keyframe_before_and_after(make_index):
+    index = make_index([0.0, 2.0, 4.0])
+    assert index.keyframe_before(2.0) == 2.0
+    assert index.keyframe_before(3.9) == 2.0
+    assert index.keyframe_after(2.1) == 4.0
+    assert index.keyframe_after(4.1) is None
+
+
+def test_nearest_keyframe(make_index):
+    index = make_index([0.0, 2.0, 4.0, 6.0])
+    assert index.nearest_keyframe(3.9) == 4.0
+    assert index.nearest_keyframe(2.1) == 2.0
+    assert index.nearest_keyframe(-5) == 0.0
+    assert index.nearest_keyframe(50) == 6.0
+
+
+def test_nearest_keyframe_skips_excluded(make_index):
+    index = make_index([0.0, 2.0, 4.0, 6.0])
+    assert index.nearest_keyframe(3.9, exclude=[4.0]) == 2.0
+    assert index.nearest_keyframe(3.9, exclude=[4.0, 2.0]) == 6.0
+    assert index.nearest_keyframe(3.9, exclude=[0.0, 2.0, 4.0, 6.0]) is None
+
+
+def test_nearest_keyframe_stays_between_start_and_end(make_index):
+    index = make_index([0.0, 2.0, 4.0, 6.0])
+    assert index.nearest_keyframe(1.9, start=3) == 4.0
+    assert index.nearest_keyframe(5.9, end=5) == 4.0
+    assert index.nearest_keyframe(3, start=2.5, end=3.5) is None
+    assert index.nearest_keyframe(3.9, start=3, end=5, exclude=[4.0]) is None
+
+
+def test_scene_cut_near(make_index):
+    index = make_index([0.0], [10.0, 13.0])
+    assert index.scene_cut_near(12.0) == 13.0
+    assert index.scene_cut_near(9.0) == 10.0
+    assert index.scene_cut_near(20.0) is None
+
+
+def test_scene_safe_points_moves_to_scene_cuts(make_index):
+    index = make_index([0.0, 2.0, 4.0, 6.0], [3.9])
+    assert index.scene_safe_points(2) == [2.0, 4.0]
+
+
+def test_scene_safe_points_gives_n_points_when_cuts_share_a_keyframe(make_index):
+    # The targets at 8, 10 and 12 are all near the scene cut at 10, only the first one can use it
+    index = make_index([float(i) for i in range(0, 21, 2)], [10.0])
+    points = index.scene_safe_points(9, end=20.0)
+    assert points == [2.0, 4.0, 6.0, 8.0, 10.0, 12.0, 14.0, 16.0, 18.0]
+
+
+def test_scene_safe_points_without_enough_keyframes(make_index):
+    index = make_index([0.0, 5.0])
+    assert index.scene_safe_points(4) == [0.0, 5.0]
+
+
+def test_scene_safe_points_stays_between_start_and_end(make_index):
+    index = make_index([float(i) for i in range(0, 101, 5)])
+    points = index.scene_safe_points(3, start=20.0, end=60.0)
+    assert points == [30.0, 40.0, 50.0]
+
+
+def test_build_keyframe_index(ffmpeg, tmp_path):
+    source = tmp_path / "input.mkv"
+    source.write_bytes(b"video")
+    cache = tmp_path / "cache"
+
+    index = gui.build_keyframe_index(ffmpeg, source, scenes=True, cache_dir=cache)
+
+    # Keyframes are every third packet, and packet 6 has no pts so its dts is used
+    assert list(index.keyframes) == [0.0, 1.5, 3.0, 4.5]
+    assert list(index.scene_times) == [1.2, 3.9]
+    assert list(index.scene_scores) == [0.5, 0.8]
+    assert [path.suffix for path in cache.iterdir()] == [".idx"]  # No temp files left behind
+    assert list(gui.load_keyframe_index(source, cache).keyframes) == [0.0, 1.5, 3.0, 4.5]
+
+
+def test_changed_file_is_not_indexed(ffmpeg, tmp_path):
+    source = tmp_path / "input.mkv"
+    source.write_bytes(b"video")
+    gui.build_keyframe_index(ffmpeg, source, cache_dir=tmp_path)
+    source.write_bytes(b"a longer video")
+    assert gui.load_keyframe_index(source, tmp_path) is None
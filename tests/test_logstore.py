@@ -0,0 +1,55 @@
+"""Checks of the bounded log that replaces stdout"""
+import simple_gui as gui
+
+
+def test_partial_lines_wait_for_the_newline():
+    log = gui.LogStore(max_lines=10)
+    log.write("first ")
+    assert len(log) == 0
+    log.write("line\nsecond")
+    assert list(log.lines) == ["first line"]
+    log.write(" line\n")
+    assert list(log.lines) == ["first line", "second line"]
+    assert log.version == 2
+
+
+def test_print_works_like_on_a_stream():
+    log = gui.LogStore(max_lines=10)
+    print("hello", 1, file=log)
+    assert list(log.lines) == ["hello 1"]
+    assert not log.isatty() and log.writable() and log.encoding == "utf-8"
+
+
+def test_main_log_keeps_only_the_newest_lines():
+    log = gui.LogStore(max_lines=3)
+    log.write("".join("{}\n".format(i) for i in range(10)))
+    assert list(log.lines) == ["7", "8", "9"]
+    assert log.version == 10
+
+
+def test_view_scrolls_back():
+    log = gui.LogStore(max_lines=100)
+    log.write("".join("{}\n".format(i) for i in range(10)))
+    assert log.view(3) == "7\n8\n9"
+    assert log.view(3, back=2) == "5\n6\n7"
+    assert log.view(3, back=8) == "0\n1"
+    assert log.view(3, back=50) == ""
+    assert log.view(20) == "\n".join(str(i) for i in range(10))
+
+
+def test_view_of_empty_log():
+    assert gui.LogStore().view(5) == ""
+    assert gui.LogStore().view(5, back=3) == ""
+
+
+def test_job_logs_are_separate_and_bounded():
+    log = gui.LogStore(max_lines=10, job_lines=2)
+    log.job("a", "one\ntwo\nthree")
+    log.job("b", "other")
+    assert log.job_log("a") == ["two", "three"]
+    assert log.job_log("b") == ["other"]
+    assert len(log) == 0  # Job output stays out of the main log
+
+    log.forget("a")
+    assert log.job_log("a") == []
+    log.forget("missing")
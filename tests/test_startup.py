@@ -0,0 +1,23 @@
+"""Guards the module load part of --benchmark-startup, the cold start of the GUI is still checked by hand"""
+import simple_gui as gui
+
+
+def test_module_loads_within_budget_without_deferred_imports():
+    load_time, eager_imports = gui.measure_module_load()
+    assert eager_imports == []
+    assert load_time <= gui.STARTUP_BUDGET
+
+
+def test_lazy_module_imports_on_first_use():
+    calls = []
+
+    def load():
+        import json
+        calls.append(json)
+        return json
+
+    module = gui.LazyModule(load)
+    assert calls == []
+    assert module.dumps([]) == "[]"
+    assert module.loads("1") == 1
+    assert len(calls) == 1
@@ -0,0 +1,315 @@
+"""Runs the dispatcher and several encode workers on localhost, with a fake ffmpeg, to check that jobs are
+shared out, and that jobs of workers that disconnect, go silent or send garbage end up back in the queue."""
+import json
+import os
+import queue
+import socket
+import stat
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+import pytest
+
+import simple_gui as gui
+
+FAKE_FFMPEG = """import sys, time
+print("fake ffmpeg")
+for frame in range(1, 11):
+    print("frame={} fps=100 q=20.0 size={}kB time=00:00:00.{:02d} bitrate=1kbits/s".format(frame, frame, frame), flush=True)
+    time.sleep(0.01)
+"""
+
+
+class Setup:
+    """The queues the GUI would own, plus a dispatcher listening on a free port"""
+
+    def __init__(self):
+        self.encode_queue = queue.Queue()
+        self.gui_queue = queue.Queue()
+        self.encode_event = queue.Queue()
+        self.analysis_queue = queue.Queue()
+        self.dispatcher = gui.Dispatcher(0, self.encode_queue, self.gui_queue, deque(maxlen=1), self.encode_event,
+                                         self.analysis_queue, gui.LogStore())
+        self.dispatcher.start()
+        self.address = "127.0.0.1:{}".format(self.dispatcher.port)
+
+    def wait_for_event(self, name, timeout=10):
+        """Wait for a job event from the dispatcher, like the GUI event loop would"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                event = self.encode_event.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            assert "uuid" in event
+            if event["event"] == name:
+                return event
+        pytest.fail("No {} event".format(name))
+
+    def wait_for_workers(self, count, timeout=5):
+        deadline = time.time() + timeout
+        # Registered workers are either idle or busy with a job
+        while self.dispatcher.consumer_count() != count or not all(worker["idle"].is_set() or worker["job"] for worker in self.dispatcher.workers):
+            assert time.time() < deadline, "Workers did not connect"
+            time.sleep(0.05)
+
+
+@pytest.fixture(autouse=True)
+def fast_timeouts(monkeypatch):
+    monkeypatch.setattr(gui, "HEARTBEAT_INTERVAL", 0.1)
+    monkeypatch.setattr(gui, "LEASE_TIMEOUT", 0.5)
+    monkeypatch.setattr(gui, "WORKER_RETRY", 0.1)
+    monkeypatch.setattr(gui, "ASSIGN_TIMEOUT", 0.1)
+    gui.encode_queue_active.set()
+
+
+@pytest.fixture
+def setup():
+    setup = Setup()
+    yield setup
+    setup.dispatcher.stop()
+
+
+@pytest.fixture
+def ffmpeg(tmp_path):
+    script = tmp_path / "ffmpeg.py"
+    script.write_text(FAKE_FFMPEG)
+    if os.name == "nt":
+        path = tmp_path / "ffmpeg.bat"
+        path.write_text('@"{}" "{}" %*\n'.format(sys.executable, script))
+    else:
+        path = tmp_path / "ffmpeg"
+        path.write_text("#!{}\n".format(sys.executable) + FAKE_FFMPEG)
+        path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return path
+
+
+@pytest.fixture
+def workers(setup, ffmpeg):
+    """Start in-process encode workers, they are stopped when the test ends"""
+    stop = threading.Event()
+
+    def start(count, ffmpeg_path=ffmpeg):
+        for _ in range(count):
+            threading.Thread(target=gui.worker_main, args=(setup.address, ffmpeg_path, stop), daemon=True).start()
+        setup.wait_for_workers(count)
+
+    yield start
+    stop.set()
+
+
+def make_job(tmp_path, title="job"):
+    return {"title": title, "uuid": str(uuid.uuid4()), "command": ["ffmpeg", "-i", "in.mkv", "out.mkv"], "test_encode": 10,
+            "metadata": {"frame_count": 10}, "input_file": tmp_path / "in.mkv", "output_file": tmp_path / "out.mkv",
+            "status": "⏱ waiting"}
+
+
+class FakeWorker:
+    """A worker that does only what the test tells it to"""
+
+    def __init__(self, address):
+        host, port = address.rsplit(":", 1)
+        self.connection = socket.create_connection((host, int(port)))
+        self.reader = self.connection.makefile("r", encoding="utf-8")
+        self.send({"type": "register", "name": "fake"})
+
+    def send(self, message):
+        self.connection.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def take_job(self):
+        self.connection.settimeout(5)
+        message = json.loads(self.reader.readline())
+        assert message["type"] == "job"
+        return message["job"]
+
+    def close(self):
+        gui.close_connection(self.connection)
+
+
+def test_several_workers_share_the_queue(setup, workers, tmp_path):
+    jobs = [make_job(tmp_path, "job {}".format(i)) for i in range(4)]
+    for job in jobs:
+        setup.encode_queue.put(job)
+    workers(2)
+
+    done = [setup.analysis_queue.get(timeout=10) for _ in jobs]
+
+    assert sorted(job["uuid"] for job in done) == sorted(job["uuid"] for job in jobs)
+    assert all(job["done_frames"] == 10 and not job["cancelled"] for job in done)
+    assert all(job["status"] == "▶ started" for job in jobs)  # Taken once, so build_encode_queue will not queue them again
+
+
+def test_job_of_disconnected_worker_is_put_back(setup, tmp_path):
+    job = make_job(tmp_path)
+    setup.encode_queue.put(job)
+    worker = FakeWorker(setup.address)
+    assert worker.take_job()["uuid"] == job["uuid"]
+    assert job["status"] == "▶ started"
+
+    worker.close()
+
+    event = setup.wait_for_event("⏱ waiting")
+    assert event["uuid"] == job["uuid"] and event["requeue"]
+    assert job["status"] == "⏱ waiting"
+    assert setup.dispatcher.consumer_count() == 0
+
+
+def test_heartbeats_keep_the_lease(setup, workers, tmp_path, monkeypatch):
+    monkeypatch.setattr(gui, "LEASE_TIMEOUT", 0.3)
+    workers(1)
+    time.sleep(1)
+    assert setup.dispatcher.consumer_count() == 1
+
+
+def test_lease_of_silent_worker_expires(setup, workers, tmp_path):
+    job = make_job(tmp_path)
+    setup.encode_queue.put(job)
+    silent = FakeWorker(setup.address)
+    silent.take_job()  # Then never says anything again
+
+    setup.wait_for_event("⏱ waiting")
+    assert setup.dispatcher.consumer_count() == 0
+
+    # Put back by the GUI, then picked up by a worker that is alive
+    setup.encode_queue.put(job)
+    workers(1)
+    assert setup.analysis_queue.get(timeout=10)["uuid"] == job["uuid"]
+    silent.close()
+
+
+def test_bad_messages_do_not_leak_the_worker(setup, tmp_path):
+    job = make_job(tmp_path)
+    setup.encode_queue.put(job)
+    worker = FakeWorker(setup.address)
+    worker.take_job()
+
+    worker.send([])
+    worker.send({"type": "done"})
+    worker.send({"type": "event", "data": {"event": "✓ finished"}})
+    worker.send({"type": "log", "data": "no uuid"})
+    worker.send({"type": "heartbeat"})
+    time.sleep(0.3)
+    assert setup.dispatcher.consumer_count() == 1
+    assert setup.encode_event.empty()
+
+    worker.connection.sendall(b"not json\n")
+
+    assert setup.wait_for_event("⏱ waiting")["uuid"] == job["uuid"]
+    assert setup.dispatcher.consumer_count() == 0
+    worker.close()
+
+
+def test_failed_encode_is_reported(setup, workers, tmp_path):
+    job = make_job(tmp_path)
+    setup.encode_queue.put(job)
+    workers(1, tmp_path / "missing-ffmpeg")
+
+    assert setup.wait_for_event("❌ failed")["uuid"] == job["uuid"]
+    assert setup.dispatcher.consumer_count() == 1
+
+
+def test_pause_reaches_every_consumer(setup, workers, tmp_path):
+    workers(2)
+    gui.encode_queue_active.clear()
+    try:
+        gui.wake_encode_consumers(setup.encode_queue, setup.dispatcher)
+        time.sleep(0.3)
+        # Each worker took its own _skip and is now waiting for the queue to resume,
+        # the one left is for the local encode thread
+        assert setup.encode_queue.qsize() == 1
+        setup.encode_queue.get_nowait()
+
+        job = make_job(tmp_path)
+        setup.encode_queue.put(job)
+        time.sleep(0.3)
+        assert job["status"] == "⏱ waiting"
+    finally:
+        gui.encode_queue_active.set()
+    assert setup.analysis_queue.get(timeout=10)["uuid"] == job["uuid"]
+
+
+def rebuild_queue(setup, encode_list):
+    """Put lost jobs back like the GUI does, by rebuilding the queue from the waiting jobs in the encode list"""
+    while not setup.encode_event.empty():
+        if setup.encode_event.get_nowait().get("requeue"):
+            gui.clear_queue(setup.encode_queue)
+            for job in encode_list:
+                if job["status"] == "⏱ waiting":
+                    setup.encode_queue.put(job)
+
+
+def test_idle_worker_that_leaves_does_not_reorder_the_queue(setup, tmp_path, monkeypatch):
+    monkeypatch.setattr(gui, "ASSIGN_TIMEOUT", 2)  # So the thread of the worker is still waiting for a job when it leaves
+    worker = FakeWorker(setup.address)
+    setup.wait_for_workers(1)
+    worker.close()
+    setup.wait_for_workers(0)
+
+    encode_list = [make_job(tmp_path, title) for title in "ABC"]
+    for job in encode_list:
+        setup.encode_queue.put(job)
+    time.sleep(0.3)
+    rebuild_queue(setup, encode_list)
+
+    order = []
+    while not setup.encode_queue.empty():
+        order.append(setup.encode_queue.get_nowait()["title"])
+    assert order == ["A", "B", "C"]
+    assert all(job["status"] == "⏱ waiting" for job in encode_list)
+
+
+def test_encode_thread_survives_a_failed_encode(ffmpeg, tmp_path):
+    encode_queue, gui_queue, encode_event, analysis_queue = queue.Queue(), queue.Queue(), queue.Queue(), queue.Queue()
+    broken = make_job(tmp_path, "broken")
+    broken["command"][0] = str(tmp_path / "missing-ffmpeg")
+    working = make_job(tmp_path, "working")
+    working["command"][0] = str(ffmpeg)
+    for job in (broken, working, gui._sentinel):
+        encode_queue.put(job)
+
+    thread = threading.Thread(target=gui.encode_thread, args=(encode_queue, gui_queue, deque(maxlen=1), encode_event, analysis_queue, gui.LogStore()), daemon=True)
+    thread.start()
+    thread.join(10)
+
+    assert not thread.is_alive()
+    assert {"uuid": broken["uuid"], "event": "❌ failed"} in list(encode_event.queue)
+    assert analysis_queue.get_nowait()["uuid"] == working["uuid"]
+    assert not gui.encode_running.is_set()
+
+
+def test_stale_stop_does_not_stop_the_next_encode(ffmpeg, tmp_path):
+    job = make_job(tmp_path)
+    job["command"][0] = str(ffmpeg)
+    gui.stoprequest.set()  # Left over from a stop that came after the last encode had finished
+    done_frames, cancelled = gui.run_encode(job, queue.Queue(), deque(maxlen=1), queue.Queue(), gui.LogStore())
+    assert (done_frames, cancelled) == (10, False)
+
+
+def test_worker_ignores_cancel_for_other_jobs(ffmpeg, tmp_path):
+    server = socket.create_server(("127.0.0.1", 0))
+    stop = threading.Event()
+    threading.Thread(target=gui.worker_main, args=("127.0.0.1:{}".format(server.getsockname()[1]), ffmpeg, stop), daemon=True).start()
+    server.settimeout(5)
+    connection, _ = server.accept()
+    connection.settimeout(5)
+    reader = connection.makefile("r", encoding="utf-8")
+    lock = threading.Lock()
+    try:
+        assert json.loads(reader.readline())["type"] == "register"
+        job = make_job(tmp_path)
+        gui.send_message(connection, lock, {"type": "cancel", "uuid": "finished earlier"})
+        gui.send_message(connection, lock, {"type": "cancel"})
+        gui.send_message(connection, lock, {"type": "job", "job": job})
+        for line in reader:
+            message = json.loads(line)
+            if message["type"] == "done":
+                break
+        assert message["uuid"] == job["uuid"]
+        assert (message["done_frames"], message["cancelled"]) == (10, False)
+    finally:
+        stop.set()
+        gui.close_connection(connection)
+        server.close()